@@ -0,0 +1,226 @@
+"""Capacity benchmark for the API against local Ollama/SearXNG stubs.
+
+Starts the stubs (bench/stubs.py), launches ``main:app`` under uvicorn with
+OLLAMA_BASE_URL / SEARXNG_BASE_URL / DATABASE_URL pointed at them (SQLite by
+default, so no PostgreSQL is needed), registers a benchmark user and drives a
+weighted mix of /api/chat, /api/voice, /api/health, /api/road-safety and
+/api/analyze/report at increasing concurrency. For every level it prints
+p50/p95/p99 time to first SSE frame and total latency per endpoint, plus
+completed streams per second.
+
+    python -m bench.load_test --concurrency 1,4,16,64 --requests 200 --token-rate 40
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from bench.stubs import StubSettings, start_stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Relative share of each endpoint in the mixed workload
+DEFAULT_MIX = {"chat": 40, "voice": 20, "health": 15, "road-safety": 15, "report": 10}
+
+PROMPTS = [
+    "what to do after a minor accident",
+    "how to treat a burn at home",
+    "my friend fainted what should I do",
+    "signs of a concussion after a fall",
+    "how to stop a nose bleed",
+    "is it safe to drive with a headache",
+    "what should be in a car first aid kit",
+    "how to help someone having a panic attack",
+]
+
+
+class Sample:
+    def __init__(self, endpoint: str, status: int, ttft: Optional[float], total: float, frames: int):
+        self.endpoint = endpoint
+        self.status = status
+        self.ttft = ttft
+        self.total = total
+        self.frames = frames
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def build_request(endpoint: str, base: str, user_id: str, prompt: str):
+    """(method, url, kwargs) for one request of the given kind."""
+    if endpoint == "chat":
+        return "POST", f"{base}/api/chat", {"data": {"user_id": user_id, "query": prompt}}
+    if endpoint == "voice":
+        return "POST", f"{base}/api/voice", {"params": {"prompt": prompt}}
+    if endpoint == "health":
+        return "GET", f"{base}/api/health", {"params": {"query": prompt}}
+    if endpoint == "road-safety":
+        return "GET", f"{base}/api/road-safety", {"params": {"prompt": prompt}}
+    if endpoint == "report":
+        form = aiohttp.FormData()
+        form.add_field("description", f"Emergency report: {prompt}")
+        return "POST", f"{base}/api/analyze/report", {"data": form}
+    raise ValueError(endpoint)
+
+
+async def run_one(session: aiohttp.ClientSession, endpoint: str, base: str, user_id: str, prompt: str) -> Sample:
+    method, url, kwargs = build_request(endpoint, base, user_id, prompt)
+    started = time.perf_counter()
+    ttft = None
+    frames = 0
+    try:
+        async with session.request(method, url, **kwargs) as response:
+            async for line in response.content:
+                if line.startswith(b"data:"):
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    frames += 1
+            status = response.status
+    except aiohttp.ClientError:
+        status = 0
+    return Sample(endpoint, status, ttft, time.perf_counter() - started, frames)
+
+
+async def run_level(base: str, user_id: str, concurrency: int, total: int, mix: Dict[str, int], prompt_pool: int):
+    endpoints = random.choices(list(mix), weights=list(mix.values()), k=total)
+    prompts = PROMPTS[:max(1, prompt_pool)] if prompt_pool <= len(PROMPTS) else None
+    queue: asyncio.Queue = asyncio.Queue()
+    for i, endpoint in enumerate(endpoints):
+        prompt = random.choice(prompts) if prompts else f"{random.choice(PROMPTS)} (case {i})"
+        queue.put_nowait((endpoint, prompt))
+
+    samples: List[Sample] = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=600)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def worker():
+            while not queue.empty():
+                endpoint, prompt = queue.get_nowait()
+                samples.append(await run_one(session, endpoint, base, user_id, prompt))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return samples, elapsed
+
+
+def report(concurrency: int, samples: List[Sample], elapsed: float):
+    ok = [s for s in samples if s.status == 200]
+    print(f"\n=== concurrency {concurrency}: {len(samples)} requests in {elapsed:.1f}s, "
+          f"{len(ok) / elapsed:.2f} streams/s, {len(samples) - len(ok)} non-200 ===")
+    print(f"{'endpoint':<12} {'n':>5} {'err':>4} {'ttft p50':>9} {'p95':>7} {'p99':>7} "
+          f"{'total p50':>10} {'p95':>7} {'p99':>7} {'frames':>7}")
+    for endpoint in sorted({s.endpoint for s in samples}):
+        group = [s for s in samples if s.endpoint == endpoint]
+        good = [s for s in group if s.status == 200]
+        ttfts = [s.ttft for s in good if s.ttft is not None]
+        totals = [s.total for s in good]
+        frames = sum(s.frames for s in good) / len(good) if good else 0
+        print(f"{endpoint:<12} {len(group):>5} {len(group) - len(good):>4} "
+              f"{percentile(ttfts, 50):>9.3f} {percentile(ttfts, 95):>7.3f} {percentile(ttfts, 99):>7.3f} "
+              f"{percentile(totals, 50):>10.3f} {percentile(totals, 95):>7.3f} {percentile(totals, 99):>7.3f} "
+              f"{frames:>7.1f}")
+
+
+async def wait_until_up(url: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+async def register_user(base: str) -> str:
+    username = f"bench-{int(time.time())}-{random.randint(0, 9999)}"
+    async with aiohttp.ClientSession() as session:
+        async with session.post(f"{base}/api/auth/register", json={
+            "username": username, "password": "bench", "name": "Bench", "contact": "0",
+        }) as response:
+            body = await response.json()
+            if response.status != 200:
+                raise RuntimeError(f"Could not register benchmark user: {body}")
+            return str(body["user_id"])
+
+
+async def main_async(args):
+    settings = StubSettings(
+        token_rate=args.token_rate,
+        ttft=args.ttft,
+        tokens_per_response=args.tokens,
+        search_latency=args.search_latency,
+    )
+    runners, stub_stats = await start_stubs(settings, args.ollama_port, args.searxng_port)
+
+    env = dict(
+        os.environ,
+        OLLAMA_BASE_URL=f"http://127.0.0.1:{args.ollama_port}/api",
+        SEARXNG_BASE_URL=f"http://127.0.0.1:{args.searxng_port}",
+        DATABASE_URL=args.database_url,
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(args.app_port), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT,
+        env=env,
+    )
+    base = f"http://127.0.0.1:{args.app_port}"
+    try:
+        await wait_until_up(f"{base}/")
+        user_id = await register_user(base)
+        mix = dict(DEFAULT_MIX)
+        for endpoint in args.skip:
+            mix.pop(endpoint, None)
+
+        for concurrency in args.concurrency:
+            samples, elapsed = await run_level(base, user_id, concurrency, args.requests, mix, args.prompt_pool)
+            report(concurrency, samples, elapsed)
+            print(f"stub: {stub_stats.generations} generations, peak {stub_stats.peak_active} concurrent, "
+                  f"{stub_stats.cancelled} cancelled, {stub_stats.searches} searches")
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-workload capacity benchmark")
+    parser.add_argument("--concurrency", default="1,4,16,64",
+                        type=lambda v: [int(x) for x in v.split(",")])
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--token-rate", type=float, default=40.0)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--search-latency", type=float, default=0.15)
+    parser.add_argument("--prompt-pool", type=int, default=len(PROMPTS) + 1,
+                        help="distinct prompts to draw from; larger than the built-in list makes every prompt unique")
+    parser.add_argument("--skip", nargs="*", default=[], choices=list(DEFAULT_MIX))
+    parser.add_argument("--app-port", type=int, default=18000)
+    parser.add_argument("--ollama-port", type=int, default=18434)
+    parser.add_argument("--searxng-port", type=int, default=18080)
+    parser.add_argument("--database-url", default=f"sqlite:///{os.path.join(tempfile.gettempdir(), 'heylini-bench.db')}")
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
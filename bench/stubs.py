@@ -0,0 +1,179 @@
+"""Local stand-ins for Ollama and SearXNG used by the load-testing harness.
+
+They imitate the wire behaviour the app depends on: Ollama's NDJSON streaming
+from /api/chat and /api/generate, /api/tags, and SearXNG's /search JSON.
+Token rate, time to first token and search latency are configurable, so the
+app can be measured without a GPU or the internet.
+
+Run standalone:
+    python -m bench.stubs --ollama-port 11434 --searxng-port 8080 --token-rate 40
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from aiohttp import web
+
+WORDS = (
+    "stay calm apply pressure to the wound keep the person still call emergency services "
+    "drink water rest monitor breathing check for signs of shock cover with a blanket"
+).split()
+
+
+class StubSettings:
+    def __init__(
+        self,
+        token_rate: float = 40.0,
+        ttft: float = 0.2,
+        tokens_per_response: int = 120,
+        search_latency: float = 0.15,
+        query_latency: float = 0.4,
+        jitter: float = 0.1,
+    ):
+        self.token_rate = token_rate
+        self.ttft = ttft
+        self.tokens_per_response = tokens_per_response
+        self.search_latency = search_latency
+        self.query_latency = query_latency
+        self.jitter = jitter
+
+    def delay(self, base: float) -> float:
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+class StubStats:
+    def __init__(self):
+        self.generations = 0
+        self.active = 0
+        self.peak_active = 0
+        self.cancelled = 0
+        self.tokens = 0
+        self.searches = 0
+
+
+def create_ollama_app(settings: StubSettings, stats: StubStats) -> web.Application:
+    async def stream_tokens(request: web.Request, key: str) -> web.StreamResponse:
+        body = await request.json()
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        stats.generations += 1
+        stats.active += 1
+        stats.peak_active = max(stats.peak_active, stats.active)
+        started = time.perf_counter()
+        try:
+            await asyncio.sleep(settings.delay(settings.ttft))
+            interval = 1.0 / settings.token_rate
+            for i in range(settings.tokens_per_response):
+                token = random.choice(WORDS) + (". " if i % 12 == 11 else " ")
+                line = {"model": body.get("model"), "done": False}
+                if key == "message":
+                    line["message"] = {"role": "assistant", "content": token}
+                else:
+                    line["response"] = token
+                await response.write((json.dumps(line) + "\n").encode())
+                stats.tokens += 1
+                await asyncio.sleep(settings.delay(interval))
+            done = {
+                "model": body.get("model"),
+                "done": True,
+                "eval_count": settings.tokens_per_response,
+                "total_duration": int((time.perf_counter() - started) * 1e9),
+            }
+            await response.write((json.dumps(done) + "\n").encode())
+            await response.write_eof()
+        except ConnectionResetError:
+            # Client (the app) closed the stream: stop generating, like Ollama does
+            stats.cancelled += 1
+        except asyncio.CancelledError:
+            stats.cancelled += 1
+            raise
+        finally:
+            stats.active -= 1
+        return response
+
+    async def chat(request: web.Request):
+        return await stream_tokens(request, "message")
+
+    async def generate(request: web.Request):
+        body = await request.json()
+        if body.get("stream", True):
+            return await stream_tokens(request, "response")
+        await asyncio.sleep(settings.delay(settings.query_latency))
+        payload = {"search_query": "first aid guidance", "categories": ["general", "news"]}
+        return web.json_response({"model": body.get("model"), "response": json.dumps(payload), "done": True})
+
+    async def tags(request: web.Request):
+        return web.json_response({"models": [
+            {"name": "gemma3:4b"}, {"name": "gemma3:1b"},
+        ]})
+
+    app = web.Application()
+    app.router.add_post("/api/chat", chat)
+    app.router.add_post("/api/generate", generate)
+    app.router.add_get("/api/tags", tags)
+    return app
+
+
+def create_searxng_app(settings: StubSettings, stats: StubStats) -> web.Application:
+    async def search(request: web.Request):
+        stats.searches += 1
+        await asyncio.sleep(settings.delay(settings.search_latency))
+        query = request.query.get("q", "")
+        category = request.query.get("categories", "general")
+        results = [
+            {
+                "title": f"{query} guide {i}",
+                "url": f"https://site{i}.example.org/{category}/{i}",
+                "content": " ".join(random.choice(WORDS) for _ in range(40)) + f" {query}",
+                "engine": "stub",
+                "score": 1.0 / (i + 1),
+                "category": category,
+            }
+            for i in range(10)
+        ]
+        return web.json_response({"query": query, "results": results})
+
+    app = web.Application()
+    app.router.add_get("/search", search)
+    return app
+
+
+async def start_stubs(settings: StubSettings, ollama_port: int, searxng_port: int, host: str = "127.0.0.1"):
+    """Start both stubs on the running loop; returns (runners, stats)."""
+    stats = StubStats()
+    runners = []
+    for app, port in (
+        (create_ollama_app(settings, stats), ollama_port),
+        (create_searxng_app(settings, stats), searxng_port),
+    ):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        runners.append(runner)
+    return runners, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Ollama and SearXNG servers")
+    parser.add_argument("--ollama-port", type=int, default=11434)
+    parser.add_argument("--searxng-port", type=int, default=8080)
+    parser.add_argument("--token-rate", type=float, default=40.0, help="tokens per second per stream")
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--tokens", type=int, default=120, help="tokens per response")
+    parser.add_argument("--search-latency", type=float, default=0.15)
+    args = parser.parse_args()
+
+    settings = StubSettings(args.token_rate, args.ttft, args.tokens, args.search_latency)
+
+    async def run():
+        await start_stubs(settings, args.ollama_port, args.searxng_port)
+        print(f"Ollama stub on :{args.ollama_port}, SearXNG stub on :{args.searxng_port}")
+        await asyncio.Event().wait()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+from brain.model_router import model_router
+from brain.ollama_client import OLLAMA_MODEL, OllamaError, ollama_client
+from brain.scheduler import model_scheduler
+from configs.prompt_registry import estimate_tokens
+from configs.response_rules import summary_message
+from db.database import AsyncSessionLocal
+from db.models import ConversationSummary
+
+logger = logging.getLogger(__name__)
+
+# Token budget for conversation history (summary + verbatim turns) per endpoint
+CONTEXT_BUDGETS: Dict[str, int] = {
+    "chat": int(os.getenv("CONTEXT_BUDGET_CHAT", "3072")),
+    "voice": int(os.getenv("CONTEXT_BUDGET_VOICE", "768")),
+}
+# Most recent turns always kept verbatim, even if they alone exceed the budget
+MIN_RECENT_TURNS = 2
+# Only re-summarize once this many turns have fallen out of the window
+SUMMARY_REFRESH_TURNS = int(os.getenv("SUMMARY_REFRESH_TURNS", "4"))
+SUMMARY_MAX_TURN_CHARS = 2000
+# Most messages read per request, should the summary fall far behind (e.g. the model was down)
+HISTORY_WINDOW_MAX = int(os.getenv("HISTORY_WINDOW_MAX", "200"))
+
+
+class ContextManager:
+    """Fits conversation history into a per-endpoint token budget.
+
+    Recent turns are sent verbatim; everything older is represented by a
+    rolling summary stored in ``conversation_summaries``. The summary is
+    extended in the background only after enough turns have fallen out of
+    the window, so most requests just read it. Turns the summary does not
+    cover yet are sent verbatim even beyond the budget, so nothing is lost
+    while a refresh is pending or failing.
+    """
+
+    def __init__(self, model: str = OLLAMA_MODEL):
+        self.model = model
+        self.client = ollama_client
+        self._refreshing: Set[str] = set()
+        # Strong references: the loop only keeps weak ones to running tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    def budget(self, endpoint: str) -> int:
+        return CONTEXT_BUDGETS.get(endpoint, CONTEXT_BUDGETS["chat"])
+
+    def fit(
+        self,
+        history: List[Dict],
+        summary: Optional[ConversationSummary],
+        endpoint: str = "chat",
+        offset: int = 0
+    ) -> Tuple[List[Dict], int]:
+        """Return the messages to send and the index where the budgeted window starts.
+
+        Turns before that index are due to be folded into the summary (see
+        ``schedule_refresh``); until the summary covers them they are still
+        sent verbatim. ``history`` may be a window of the conversation starting
+        at turn ``offset``; the returned index counts from the start of the
+        conversation.
+        """
+        budget = self.budget(endpoint)
+        summary_text = summary.summary if summary else ""
+        covered_turns = summary.covered_turns if summary else 0
+        covered = max(covered_turns - offset, 0)
+        budget -= estimate_tokens(summary_text)
+
+        first_verbatim = len(history)
+        used = 0
+        for index in range(len(history) - 1, -1, -1):
+            tokens = estimate_tokens(history[index].get("content", ""))
+            kept = len(history) - index - 1
+            if used + tokens > budget and kept >= MIN_RECENT_TURNS:
+                break
+            used += tokens
+            first_verbatim = index
+
+        messages = []
+        if summary_text and covered_turns > 0:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary_text}"
+            })
+            # Turns already in the summary are never repeated verbatim
+            first_verbatim = max(first_verbatim, min(covered, len(history)))
+        else:
+            covered = 0
+        # Everything after the summary goes in, even past the budget: turns
+        # outside the window are only dropped once the summary covers them
+        messages.extend(
+            {"role": turn["role"], "content": turn["content"]}
+            for turn in history[covered:]
+        )
+        return messages, offset + first_verbatim
+
+    def needs_refresh(self, summary: Optional[ConversationSummary], first_verbatim: int) -> bool:
+        covered = summary.covered_turns if summary else 0
+        return first_verbatim - covered >= SUMMARY_REFRESH_TURNS
+
+    def schedule_refresh(
+        self,
+        conversation_id: str,
+        history: List[Dict],
+        summary: Optional[ConversationSummary],
+        first_verbatim: int,
+        offset: int = 0
+    ):
+        """Fold turns that left the window into the summary, off the request path."""
+        if not conversation_id or not self.needs_refresh(summary, first_verbatim):
+            return
+        if conversation_id in self._refreshing:
+            return
+        self._refreshing.add(conversation_id)
+        previous = summary.summary if summary else ""
+        covered = summary.covered_turns if summary else 0
+        turns = history[max(covered - offset, 0):first_verbatim - offset]
+        task = asyncio.create_task(self._refresh(conversation_id, previous, turns, first_verbatim))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, conversation_id: str, previous: str, turns: List[Dict], covered_turns: int):
+        try:
+            text = "\n".join(
+                f"{turn['role']}: {turn['content'][:SUMMARY_MAX_TURN_CHARS]}" for turn in turns
+            )
+            data = {
+                "model": self.model,
+                "prompt": summary_message(previous, text),
+                "stream": False,
+                "options": {"temperature": 0.2, "num_predict": 256}
+            }
+            model_router.route(data, "chat")
+            async with model_scheduler.slot("chat"):
+                try:
+                    response = await self.client.post("generate", data)
+                except OllamaError as e:
+                    if not model_router.fall_back(data, e, "chat"):
+                        raise
+                    response = await self.client.post("generate", data)
+            new_summary = response.get("response", "").strip()
+            if new_summary:
+                await save_summary(conversation_id, new_summary, covered_turns)
+        except Exception as e:
+            logger.error(f"Failed to refresh summary for conversation {conversation_id}: {str(e)}")
+        finally:
+            self._refreshing.discard(conversation_id)
+
+
+async def get_summary(conversation_id: int, db) -> Optional[ConversationSummary]:
+    return await db.get(ConversationSummary, conversation_id)
+
+
+async def save_summary(conversation_id: int, summary: str, covered_turns: int):
+    async with AsyncSessionLocal() as db:
+        row = await get_summary(conversation_id, db)
+        if row is None:
+            row = ConversationSummary(conversation_id=conversation_id)
+            db.add(row)
+        elif row.covered_turns >= covered_turns:
+            return
+        row.summary = summary
+        row.covered_turns = covered_turns
+        await db.commit()
+
+
+context_manager = ContextManager()
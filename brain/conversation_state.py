@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+CONVERSATION_STATE_MAX_BYTES = int(os.getenv("CONVERSATION_STATE_MAX_BYTES", str(32 * 1024 * 1024)))
+CONVERSATION_STATE_MAX_ENTRIES = int(os.getenv("CONVERSATION_STATE_MAX_ENTRIES", "10000"))
+CONVERSATION_STATE_IDLE_TTL = float(os.getenv("CONVERSATION_STATE_IDLE_TTL", "1800"))
+# Messages kept per conversation; older ones are dropped first
+CONVERSATION_STATE_MAX_MESSAGES = int(os.getenv("CONVERSATION_STATE_MAX_MESSAGES", "40"))
+
+
+def _message_size(message: Dict) -> int:
+    return len(json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+
+class ConversationState:
+    def __init__(self):
+        self.messages: List[Dict] = []
+        self.size_bytes = 0
+        self.last_access = time.monotonic()
+
+
+class ConversationStateStore:
+    """Bounded in-memory message state per (user_id, conversation_id).
+
+    Replaces the old process-global ``ChatModel.conversation_history`` list,
+    which every user shared and which grew forever. Entries are evicted in LRU
+    order when the byte or entry cap is hit, and dropped after ``idle_ttl``
+    seconds without access. Safe to use from worker threads.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = CONVERSATION_STATE_MAX_BYTES,
+        max_entries: int = CONVERSATION_STATE_MAX_ENTRIES,
+        idle_ttl: float = CONVERSATION_STATE_IDLE_TTL,
+        max_messages: int = CONVERSATION_STATE_MAX_MESSAGES,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.max_messages = max_messages
+        self.size_bytes = 0
+        self.evictions = {"lru": 0, "idle": 0}
+        self._states: "OrderedDict[Tuple[str, str], ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(user_id, conversation_id) -> Tuple[str, str]:
+        return (str(user_id), str(conversation_id or ""))
+
+    def get_messages(self, user_id, conversation_id) -> List[Dict]:
+        """Return a copy of the conversation's messages (empty if unknown or expired)."""
+        key = self._key(user_id, conversation_id)
+        with self._lock:
+            self._expire_idle()
+            state = self._states.get(key)
+            if state is None:
+                return []
+            state.last_access = time.monotonic()
+            self._states.move_to_end(key)
+            return list(state.messages)
+
+    def append(self, user_id, conversation_id, message: Dict):
+        key = self._key(user_id, conversation_id)
+        size = _message_size(message)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = ConversationState()
+                self._states[key] = state
+            self._states.move_to_end(key)
+            state.messages.append(message)
+            state.size_bytes += size
+            state.last_access = time.monotonic()
+            self.size_bytes += size
+
+            while len(state.messages) > self.max_messages:
+                dropped = _message_size(state.messages.pop(0))
+                state.size_bytes -= dropped
+                self.size_bytes -= dropped
+
+            self._expire_idle()
+            while self._states and (
+                self.size_bytes > self.max_bytes or len(self._states) > self.max_entries
+            ):
+                _, evicted = self._states.popitem(last=False)
+                self.size_bytes -= evicted.size_bytes
+                self.evictions["lru"] += 1
+
+    def discard(self, user_id, conversation_id):
+        with self._lock:
+            state = self._states.pop(self._key(user_id, conversation_id), None)
+            if state is not None:
+                self.size_bytes -= state.size_bytes
+
+    def _expire_idle(self):
+        # Oldest entries sit at the front, stop at the first one still fresh
+        cutoff = time.monotonic() - self.idle_ttl
+        while self._states:
+            key, state = next(iter(self._states.items()))
+            if state.last_access >= cutoff:
+                break
+            del self._states[key]
+            self.size_bytes -= state.size_bytes
+            self.evictions["idle"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._expire_idle()
+            return {
+                "conversations": len(self._states),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "idle_ttl": self.idle_ttl,
+                "evictions": dict(self.evictions),
+            }
+
+
+conversation_states = ConversationStateStore()
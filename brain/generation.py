@@ -0,0 +1,42 @@
+from typing import AsyncGenerator, Dict, List, Optional
+
+from brain.model_router import model_router
+from brain.ollama_client import OllamaError
+
+
+async def stream_tokens(
+    client, data: Dict, endpoint: str, slot=None, collect: Optional[List[str]] = None, key: Optional[str] = None
+) -> AsyncGenerator[str, None]:
+    """Content tokens of a streaming Ollama chat request; every chat generation reads its answer here.
+
+    Raises OllamaError if Ollama reports an error mid-stream or the stream
+    ends without its final ``done`` line, so a cut-off answer is never taken
+    for a complete one. ``slot`` is checked for preemption between tokens,
+    ``collect`` receives every token and ``key`` pins the backend.
+    """
+    while True:
+        emitted = False
+        finished = False
+        try:
+            async for chunk in client.stream("chat", data, key=key):
+                if slot is not None:
+                    slot.raise_if_preempted()
+                if "error" in chunk:
+                    # Ollama reports a failure during generation as a line of its own
+                    raise OllamaError(500, chunk["error"])
+                if "message" in chunk:
+                    content = chunk["message"].get("content", "")
+                    if content:
+                        if collect is not None:
+                            collect.append(content)
+                        emitted = True
+                        yield content
+                finished = finished or bool(chunk.get("done"))
+            if finished:
+                return
+            # No final done line: the answer was cut off
+            raise OllamaError(502, "stream ended before the answer was complete")
+        except OllamaError as e:
+            # Small model not installed: retry once on the large one
+            if emitted or not model_router.fall_back(data, e, endpoint):
+                raise
@@ -0,0 +1,177 @@
+import asyncio
+import base64
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it images are sent unchanged
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+# gemma3's vision encoder works on 896x896 inputs; anything larger is downscaled by Ollama anyway
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "896"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Longer side of the dashboard previews generated at upload time
+THUMBNAIL_SIDE = int(os.getenv("THUMBNAIL_SIDE", "320"))
+
+
+class ImagePipeline:
+    """Prepares photos for vision calls off the event loop.
+
+    Each image is decoded, rotated per its EXIF orientation, downscaled so its
+    longer side is at most ``max_side``, re-encoded as a metadata-free JPEG
+    and base64-encoded. Results are cached by a hash of the original bytes,
+    so a photo sent again in a follow-up turn is not processed twice.
+    """
+
+    def __init__(
+        self,
+        max_side: int = IMAGE_MAX_SIDE,
+        quality: int = IMAGE_JPEG_QUALITY,
+        workers: int = IMAGE_WORKERS,
+        cache_max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+    ):
+        self.max_side = max_side
+        self.quality = quality
+        self.cache_max_bytes = cache_max_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="image")
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self.thumbnails = 0
+        if Image is None:
+            logger.warning("Pillow is not installed, images are sent to the model without resizing")
+
+    def _cache_get(self, digest: str):
+        with self._lock:
+            encoded = self._cache.get(digest)
+            if encoded is not None:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return encoded
+
+    def _cache_put(self, digest: str, encoded: str):
+        with self._lock:
+            if digest in self._cache or len(encoded) > self.cache_max_bytes:
+                return
+            self._cache[digest] = encoded
+            self._cache_bytes += len(encoded)
+            while self._cache_bytes > self.cache_max_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted)
+
+    def _shrink(self, raw: bytes) -> bytes:
+        if Image is None:
+            return raw
+        try:
+            with Image.open(io.BytesIO(raw)) as image:
+                image = ImageOps.exif_transpose(image)
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                image.thumbnail((self.max_side, self.max_side), Image.LANCZOS)
+                out = io.BytesIO()
+                # A fresh save without exif/icc arguments drops all metadata (GPS included)
+                image.save(out, format="JPEG", quality=self.quality, optimize=True)
+                return out.getvalue()
+        except Exception as e:
+            logger.warning(f"Could not preprocess image, sending it unchanged: {str(e)}")
+            return raw
+
+    def encode_file(self, path: str) -> str:
+        """Base64 of the prepared image at ``path``; blocking, runs in a worker thread."""
+        with open(path, "rb") as image_file:
+            raw = image_file.read()
+        digest = hashlib.sha256(raw).hexdigest()
+        encoded = self._cache_get(digest)
+        if encoded is not None:
+            return encoded
+
+        started = time.perf_counter()
+        prepared = self._shrink(raw)
+        encoded = base64.b64encode(prepared).decode("utf-8")
+        with self._lock:
+            self.bytes_in += len(raw)
+            self.bytes_out += len(prepared)
+            self.seconds += time.perf_counter() - started
+        self._cache_put(digest, encoded)
+        return encoded
+
+    def encode_files(self, paths: List[str]) -> List[str]:
+        """Blocking variant for synchronous callers; images are still processed in parallel."""
+        return list(self._executor.map(self.encode_file, paths))
+
+    async def encode(self, path: str) -> str:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.encode_file, path)
+
+    async def encode_many(self, paths: List[str]) -> List[str]:
+        return list(await asyncio.gather(*(self.encode(path) for path in paths)))
+
+    def make_thumbnail(self, path: str, dest: str, side: int = THUMBNAIL_SIDE) -> bool:
+        """Write a small JPEG preview of the image at ``path`` to ``dest``; blocking, False if impossible."""
+        if Image is None:
+            return False
+        # Written under a temporary name so a concurrent reader never sees half a file
+        temp = f"{dest}.{threading.get_ident()}.part"
+        try:
+            with Image.open(path) as image:
+                image = ImageOps.exif_transpose(image)
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                image.thumbnail((side, side), Image.LANCZOS)
+                image.save(temp, format="JPEG", quality=self.quality, optimize=True)
+            os.replace(temp, dest)
+        except Exception as e:
+            logger.warning(f"Could not create thumbnail for {path}: {str(e)}")
+            if os.path.exists(temp):
+                os.remove(temp)
+            return False
+        with self._lock:
+            self.thumbnails += 1
+        return True
+
+    def schedule_thumbnail(self, path: str, dest: str):
+        """Generate the thumbnail in the worker pool without waiting for it."""
+        if Image is not None:
+            self._executor.submit(self.make_thumbnail, path, dest)
+
+    async def thumbnail(self, path: str, dest: str) -> bool:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.make_thumbnail, path, dest)
+
+    def stats(self) -> Dict:
+        return {
+            "pillow": Image is not None,
+            "max_side": self.max_side,
+            "cache_entries": len(self._cache),
+            "cache_bytes": self._cache_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "processing_seconds": round(self.seconds, 3),
+            "thumbnails": self.thumbnails,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+image_pipeline = ImagePipeline()
@@ -0,0 +1,377 @@
+import asyncio
+import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException, Request, UploadFile
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from brain.image_pipeline import image_pipeline
+from brain.uploads import IMAGE_TYPES, StoredUpload, ingest_upload, ingest_upload_sync
+from db.database import AsyncSessionLocal, SessionLocal
+from db.models import AdminNotification, Conversation, ConversationMessage, MediaBlob
+
+logger = logging.getLogger(__name__)
+
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "media")
+# Unreferenced blobs are kept this long: a file is stored before the row that
+# points at it is committed, and report photos are never referenced at all
+MEDIA_GC_GRACE_SECONDS = float(os.getenv("MEDIA_GC_GRACE_SECONDS", str(24 * 3600)))
+MEDIA_GC_INTERVAL_SECONDS = float(os.getenv("MEDIA_GC_INTERVAL_SECONDS", "3600"))
+# Blob contents never change under a name, so clients may keep them indefinitely
+MEDIA_CACHE_CONTROL = os.getenv("MEDIA_CACHE_CONTROL", "private, max-age=31536000, immutable")
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def media_digest(path: Optional[str]) -> Optional[str]:
+    """Content hash of a media store path; None for anything else (e.g. files saved before the store)."""
+    if not path:
+        return None
+    digest = os.path.basename(path).split(".", 1)[0]
+    return digest if _DIGEST.match(digest) else None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match uses weak comparison
+    return "*" in tags or etag.removeprefix("W/") in (tag.removeprefix("W/") for tag in tags)
+
+
+def conversation_media(history: Optional[List[Dict]]) -> Iterable[str]:
+    """Media paths referenced by a conversation's messages."""
+    for message in history or []:
+        yield from message.get("images") or []
+
+
+class MediaStore:
+    """Content-addressed storage for uploaded photos and voice notes.
+
+    A blob lives at ``<root>/ab/cd/<sha256>.<ext>``, so identical uploads are
+    stored once and no directory grows beyond a few hundred entries. Each blob
+    has a ``MediaBlob`` row whose ``ref_count`` follows the AdminNotification
+    and Conversation rows pointing at it; the garbage collector recomputes the
+    counts from those rows and deletes blobs that have been unreferenced for
+    longer than the grace period.
+    """
+
+    def __init__(self, root: str = MEDIA_ROOT, grace_seconds: float = MEDIA_GC_GRACE_SECONDS):
+        self.root = root
+        self.incoming = os.path.join(root, "incoming")
+        self.grace_seconds = grace_seconds
+        # Orders placing a file against the collector deleting it (single process)
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.bytes_deduplicated = 0
+        self.gc_runs = 0
+        self.gc_removed = 0
+        self.gc_bytes_removed = 0
+        self.last_gc: Dict = {}
+        self.served = 0
+        self.not_modified = 0
+        self.thumbnails_served = 0
+
+    def blob_path(self, digest: str, mime_type: str) -> str:
+        extension = mimetypes.guess_extension(mime_type) or ""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + extension)
+
+    def thumbnail_path(self, path: str) -> str:
+        return os.path.join(os.path.dirname(path), media_digest(path) + ".thumb.jpg")
+
+    def _new_blob(self, stored: StoredUpload, path: str, now: datetime) -> MediaBlob:
+        return MediaBlob(
+            sha256=stored.sha256, path=path, size=stored.size, mime_type=stored.mime_type,
+            ref_count=0, created_at=now, last_used_at=now,
+        )
+
+    def _record(self, stored: StoredUpload, path: str):
+        """Create or touch the blob's row before its file is placed, so the collector skips it.
+
+        Committed in a session of its own, so the caller's pending work is
+        neither committed nor rolled back with it.
+        """
+        now = datetime.utcnow()
+        with SessionLocal() as db:
+            blob = db.get(MediaBlob, stored.sha256)
+            if blob:
+                blob.last_used_at = now
+            else:
+                db.add(self._new_blob(stored, path, now))
+            try:
+                db.commit()
+            except IntegrityError:
+                # The same content was just stored by a concurrent request
+                db.rollback()
+
+    async def _record_async(self, stored: StoredUpload, path: str):
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            blob = await db.get(MediaBlob, stored.sha256)
+            if blob:
+                blob.last_used_at = now
+            else:
+                db.add(self._new_blob(stored, path, now))
+            try:
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+
+    def _place(self, stored: StoredUpload, path: str) -> StoredUpload:
+        """Move an ingested file to its blob path, or drop it if the content is already stored."""
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(stored.path)
+                # A fresh mtime keeps the orphan sweep away from a blob just re-uploaded
+                os.utime(path)
+                self.deduplicated += 1
+                self.bytes_deduplicated += stored.size
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(stored.path, path)
+                self.stored += 1
+                if stored.kind == "image":
+                    # Dashboards load previews; build it now rather than on the first view
+                    image_pipeline.schedule_thumbnail(path, self.thumbnail_path(path))
+        stored.path = path
+        return stored
+
+    async def save(
+        self, upload: UploadFile, allowed: Sequence[str] = IMAGE_TYPES, max_bytes: Optional[int] = None
+    ) -> StoredUpload:
+        """Stream ``upload`` into the store; the returned path is the blob's, shared by identical uploads."""
+        stored = await ingest_upload(upload, self.incoming, name=uuid.uuid4().hex, allowed=allowed, max_bytes=max_bytes)
+        path = self.blob_path(stored.sha256, stored.mime_type)
+        try:
+            await self._record_async(stored, path)
+        except BaseException:
+            await asyncio.to_thread(os.remove, stored.path)
+            raise
+        return await asyncio.to_thread(self._place, stored, path)
+
+    def save_sync(
+        self, upload: UploadFile, allowed: Sequence[str] = IMAGE_TYPES, max_bytes: Optional[int] = None
+    ) -> StoredUpload:
+        """Same as ``save`` for sync handlers."""
+        stored = ingest_upload_sync(upload, self.incoming, name=uuid.uuid4().hex, allowed=allowed, max_bytes=max_bytes)
+        path = self.blob_path(stored.sha256, stored.mime_type)
+        try:
+            self._record(stored, path)
+        except BaseException:
+            os.remove(stored.path)
+            raise
+        return self._place(stored, path)
+
+    def _adjustment(self, path: Optional[str], delta: int):
+        digest = media_digest(path)
+        if digest is None:
+            return None
+        return (
+            update(MediaBlob)
+            .where(MediaBlob.sha256 == digest)
+            .values(ref_count=MediaBlob.ref_count + delta, last_used_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+
+    def add_ref(self, db: Session, path: Optional[str]):
+        """Count a new row pointing at ``path``; committed together with that row by the caller."""
+        statement = self._adjustment(path, 1)
+        if statement is not None:
+            db.execute(statement)
+
+    def release(self, db: Session, path: Optional[str]):
+        """A row stopped pointing at ``path``."""
+        statement = self._adjustment(path, -1)
+        if statement is not None:
+            db.execute(statement)
+
+    async def add_ref_async(self, db: AsyncSession, path: Optional[str]):
+        statement = self._adjustment(path, 1)
+        if statement is not None:
+            await db.execute(statement)
+
+    def _count_references(self, db: Session) -> Counter:
+        counts: Counter = Counter()
+        columns = (AdminNotification.user_image_path, AdminNotification.user_voice_path, AdminNotification.admin_image_path)
+        for row in db.query(*columns).yield_per(500):
+            counts.update(digest for digest in map(media_digest, row) if digest)
+        for (extra,) in db.query(ConversationMessage.extra).filter(ConversationMessage.extra.isnot(None)).yield_per(500):
+            counts.update(digest for digest in map(media_digest, extra.get("images") or []) if digest)
+        # Conversations the message backfill has not reached yet
+        for (history,) in db.query(Conversation.history).filter(Conversation.message_count == 0).yield_per(200):
+            counts.update(digest for digest in map(media_digest, conversation_media(history)) if digest)
+        return counts
+
+    def _remove_file(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except FileNotFoundError:
+            return 0
+
+    def collect_garbage(self) -> Dict:
+        """One GC pass; blocking, run it in a worker thread.
+
+        Reference counts are recomputed from the referencing rows (fixing any
+        drift from crashes or deleted rows), unreferenced blobs past the grace
+        period are deleted, and files without a row (interrupted uploads) are
+        swept once they are older than the grace period.
+        """
+        started = time.perf_counter()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.grace_seconds)
+        removed = 0
+        bytes_removed = 0
+        corrected = 0
+        db = SessionLocal()
+        try:
+            counts = self._count_references(db)
+            known = set()
+            for blob in db.query(MediaBlob).all():
+                known.add(blob.sha256)
+                if blob.ref_count != counts.get(blob.sha256, 0):
+                    blob.ref_count = counts.get(blob.sha256, 0)
+                    corrected += 1
+            db.commit()
+
+            candidates = db.query(MediaBlob.sha256, MediaBlob.path).filter(
+                MediaBlob.ref_count <= 0, MediaBlob.last_used_at < cutoff
+            ).all()
+            for digest, path in candidates:
+                with self._lock:
+                    # Re-checked in the delete itself: an upload or reference may have touched it since
+                    deleted = db.query(MediaBlob).filter(
+                        MediaBlob.sha256 == digest, MediaBlob.ref_count <= 0, MediaBlob.last_used_at < cutoff
+                    ).delete(synchronize_session=False)
+                    db.commit()
+                    if deleted:
+                        known.discard(digest)
+                        bytes_removed += self._remove_file(path) + self._remove_file(self.thumbnail_path(path))
+                        removed += 1
+        finally:
+            db.close()
+
+        orphans = self._sweep_orphans(known, time.time() - self.grace_seconds)
+        self.gc_runs += 1
+        self.gc_removed += removed + orphans
+        self.gc_bytes_removed += bytes_removed
+        self.last_gc = {
+            "at": datetime.utcnow().isoformat(),
+            "seconds": round(time.perf_counter() - started, 3),
+            "refcounts_corrected": corrected,
+            "blobs_removed": removed,
+            "orphans_removed": orphans,
+            "bytes_removed": bytes_removed,
+        }
+        logger.info(f"Media GC: {self.last_gc}")
+        return self.last_gc
+
+    def _sweep_orphans(self, known: set, cutoff: float) -> int:
+        removed = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(directory, name)
+                if media_digest(name) in known:
+                    continue
+                with self._lock:
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            removed += 1
+                    except FileNotFoundError:
+                        pass
+        return removed
+
+    def resolve(self, name: str) -> Optional[str]:
+        """Store path of a blob file name such as ``<sha256>.jpg``, without a database lookup."""
+        digest = media_digest(name)
+        if digest is None or os.path.basename(name) != name:
+            return None
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    async def file_response(
+        self, request: Request, path: str, thumbnail: bool = False, filename: Optional[str] = None
+    ) -> Response:
+        """Serve ``path`` with a strong ETag, answering If-None-Match with 304.
+
+        Store blobs get their content hash as ETag and a long-lived
+        Cache-Control; other files keep Starlette's stat-based ETag. Range
+        requests (voice note seeking) are handled by ``FileResponse``. With
+        ``thumbnail`` an image is served as its preview, created on the spot
+        if the upload-time worker has not produced it.
+        """
+        digest = media_digest(path)
+        served_thumbnail = False
+        if thumbnail and digest:
+            thumb = self.thumbnail_path(path)
+            exists = await asyncio.to_thread(os.path.exists, thumb)
+            if not exists and (mimetypes.guess_type(path)[0] or "").startswith("image/"):
+                # Stored before thumbnails existed, or still queued in the worker pool
+                exists = await image_pipeline.thumbnail(path, thumb)
+            if exists:
+                path, served_thumbnail = thumb, True
+
+        try:
+            stat_result = await asyncio.to_thread(os.stat, path)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="File not found")
+
+        headers = {}
+        if digest:
+            headers["ETag"] = f'"{digest}-thumb"' if served_thumbnail else f'"{digest}"'
+            headers["Cache-Control"] = MEDIA_CACHE_CONTROL
+        response = FileResponse(
+            path,
+            headers=headers,
+            stat_result=stat_result,
+            filename=None if served_thumbnail else filename,
+        )
+        if etag_matches(request.headers.get("if-none-match"), response.headers["etag"]):
+            self.not_modified += 1
+            kept = ("etag", "cache-control", "last-modified")
+            return Response(status_code=304, headers={k: response.headers[k] for k in kept if k in response.headers})
+        self.served += 1
+        self.thumbnails_served += served_thumbnail
+        return response
+
+    async def gc_loop(self, interval: float = MEDIA_GC_INTERVAL_SECONDS):
+        """Background task: run a GC pass every ``interval`` seconds."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.collect_garbage)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Media GC failed: {str(e)}")
+
+    def stats(self) -> Dict:
+        return {
+            "root": self.root,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "bytes_deduplicated": self.bytes_deduplicated,
+            "gc_runs": self.gc_runs,
+            "gc_removed": self.gc_removed,
+            "gc_bytes_removed": self.gc_bytes_removed,
+            "last_gc": self.last_gc,
+            "served": self.served,
+            "not_modified": self.not_modified,
+            "thumbnails_served": self.thumbnails_served,
+        }
+
+
+media_store = MediaStore()
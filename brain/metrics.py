@@ -0,0 +1,277 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import AsyncGenerator, AsyncIterable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond DB hits to multi-minute generations
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = [0] * len(self.buckets) + [0.0, 0]
+                self._values[labels] = series
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_request_seconds = registry.register(Histogram(
+    "heylini_http_request_seconds", "HTTP request duration until the last body byte",
+    ("route", "method", "status"),
+))
+phase_seconds = registry.register(Histogram(
+    "heylini_phase_seconds", "Duration of request phases (db, search, query generation, queue wait)",
+    ("route", "phase"),
+))
+model_ttft_seconds = registry.register(Histogram(
+    "heylini_model_ttft_seconds", "Model time to first token", ("route", "model"),
+))
+model_stream_seconds = registry.register(Histogram(
+    "heylini_model_stream_seconds", "Total model stream time", ("route", "model"),
+))
+model_tokens_per_second = registry.register(Histogram(
+    "heylini_model_tokens_per_second", "Model decode rate after the first token", ("route", "model"),
+    buckets=RATE_BUCKETS,
+))
+model_tokens_total = registry.register(Counter(
+    "heylini_model_tokens_total", "Streamed model tokens", ("route", "model"),
+))
+client_disconnects_total = registry.register(Counter(
+    "heylini_client_disconnects_total", "Streams abandoned by the client before they finished", ("route",),
+))
+model_cancelled_total = registry.register(Counter(
+    "heylini_model_cancelled_total", "Generations aborted before the model finished", ("route", "model"),
+))
+model_reclaimed_seconds_total = registry.register(Counter(
+    "heylini_model_reclaimed_seconds_total",
+    "Estimated model time saved by aborting generations (typical duration minus elapsed)", ("route", "model"),
+))
+single_flight_total = registry.register(Counter(
+    "heylini_single_flight_total", "Requests that started a shared generation or joined a running one",
+    ("route", "role"),
+))
+model_route_total = registry.register(Counter(
+    "heylini_model_route_total", "Model chosen by the router per request", ("route", "model", "reason"),
+))
+db_pool_checkout_seconds = registry.register(Histogram(
+    "heylini_db_pool_checkout_seconds", "Time spent waiting for a database connection from the pool", ("engine",),
+))
+db_pool_timeouts_total = registry.register(Counter(
+    "heylini_db_pool_timeouts_total", "Pool checkouts that gave up after DB_POOL_TIMEOUT", ("engine",),
+))
+
+
+def observe_pool_checkout(engine: str, seconds: float, timed_out: bool):
+    """Checkout observer for db.database (registered in main.py)."""
+    db_pool_checkout_seconds.observe(seconds, engine)
+    if timed_out:
+        db_pool_timeouts_total.inc(engine)
+
+
+class Trace:
+    """Spans recorded while handling one HTTP request."""
+
+    def __init__(self, request_id: str, path: str):
+        self.request_id = request_id
+        self.path = path
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def summary(self) -> str:
+        spans = " ".join(f"{name}={duration * 1000:.1f}ms" for name, duration in self.spans)
+        total = (time.perf_counter() - self.started) * 1000
+        return f"[{self.request_id}] {self.path} total={total:.1f}ms {spans}"
+
+
+current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+
+
+def record_span(route: str, phase: str, duration: float):
+    phase_seconds.observe(duration, route, phase)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.spans.append((phase, duration))
+
+
+@contextmanager
+def span(phase: str, route: str):
+    """Time a block as ``phase`` of ``route``; works inside sync and async code."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(route, phase, time.perf_counter() - started)
+
+
+# EWMA of completed stream durations per (route, model), to estimate time saved by cancelling
+_typical_stream_seconds: Dict[Tuple[str, str], float] = {}
+
+
+async def observe_stream(
+    tokens: AsyncIterable[str], route: str, model: str, on_ttft: Optional[Callable[[float], None]] = None
+) -> AsyncGenerator[str, None]:
+    """Pass tokens through while recording TTFT, decode rate and total stream time.
+
+    A stream that is cancelled or closed before the model finished (client
+    disconnect) is counted, with an estimate of the generation time it saved.
+    """
+    started = time.perf_counter()
+    first_token_at = None
+    count = 0
+    iterator = tokens.__aiter__()
+    try:
+        async for token in iterator:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+                model_ttft_seconds.observe(first_token_at - started, route, model)
+                record_span(route, "model_ttft", first_token_at - started)
+                if on_ttft is not None:
+                    on_ttft(first_token_at - started)
+            count += 1
+            yield token
+        elapsed = time.perf_counter() - started
+        typical = _typical_stream_seconds.get((route, model))
+        _typical_stream_seconds[(route, model)] = elapsed if typical is None else 0.8 * typical + 0.2 * elapsed
+    except (asyncio.CancelledError, GeneratorExit):
+        elapsed = time.perf_counter() - started
+        model_cancelled_total.inc(route, model)
+        typical = _typical_stream_seconds.get((route, model))
+        if typical is not None and typical > elapsed:
+            model_reclaimed_seconds_total.inc(route, model, amount=typical - elapsed)
+        raise
+    finally:
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        finished = time.perf_counter()
+        model_stream_seconds.observe(finished - started, route, model)
+        record_span(route, "model_stream", finished - started)
+        if count:
+            model_tokens_total.inc(route, model, amount=count)
+        if first_token_at is not None and count > 1 and finished > first_token_at:
+            model_tokens_per_second.observe((count - 1) / (finished - first_token_at), route, model)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: per-request trace, request id header and duration histogram.
+
+    It wraps ``send`` rather than the response object so streamed (SSE)
+    responses are timed until their last chunk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(uuid.uuid4().hex[:12], scope.get("path", ""))
+        token = current_trace.set(trace)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-request-id", trace.request_id.encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            duration = time.perf_counter() - trace.started
+            http_request_seconds.observe(duration, route_path, scope.get("method", ""), str(status["code"]))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(trace.summary())
+            current_trace.reset(token)
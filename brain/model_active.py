@@ -1,37 +1,34 @@
-import base64
-import aiohttp
 import json
 from typing import AsyncGenerator
-from configs.response_rules import (
-    search_response_context,
-    system_message,
-    search_message,
-    voice_message_rule,
-    health_assistant_system_message,
-    accident_assistant_system_message
-)
+from configs.prompt_registry import prompt_registry
+from brain.generation import stream_tokens
+from brain.image_pipeline import image_pipeline
+from brain.ollama_client import OLLAMA_MODEL, OllamaError, ollama_client
+from brain.metrics import observe_stream
+from brain.model_router import model_router
+from brain.scheduler import Preempted, SchedulerBusy, model_scheduler
+from brain.sse import encode_sse
 import logging
 
 logger = logging.getLogger(__name__)
 
 class ModelInit:
     def __init__(self):
-        self.model = "gemma3:4b"
-        self.base_url = "http://localhost:11434/api/"
+        self.model = OLLAMA_MODEL
+        self.client = ollama_client
     
     async def text_offline_response(
         self, 
         query: str, 
         history: list, 
-        is_voice: bool = False
+        is_voice: bool = False,
+        conversation_id: str = None
     ) -> AsyncGenerator[str, None]:
         """Generate text response from the local model"""
-        url = f"{self.base_url}chat"
-        headers = {"Content-Type": "application/json"}
-
-        rules = voice_message_rule if is_voice else system_message
+        # Precompiled, byte-identical system prompt keeps Ollama's prefix cache warm
+        rules = prompt_registry.text("voice" if is_voice else "chat")
         messages = [
-            {"role": "system", "content": "\n".join(rules)},
+            {"role": "system", "content": rules},
             *history,
             {"role": "user", "content": query}
         ]
@@ -43,25 +40,23 @@ class ModelInit:
         }
 
         logger.info(f"Sending text request to model: {query}")
-        async for chunk in self._stream_response(payload, url, headers):
+        endpoint = "voice" if is_voice else "chat"
+        async for chunk in self._stream_response(payload, endpoint, key=conversation_id):
             yield chunk
 
     async def image_offline_response(
         self, 
         query: str, 
         history: list, 
-        image_path: str
+        image_path: str,
+        conversation_id: str = None
     ) -> AsyncGenerator[str, None]:
         """Generate response for image analysis"""
-        url = f"{self.base_url}chat"
-        headers = {"Content-Type": "application/json"}
-
-        # Read and encode image
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode("utf-8")
+        # Downscaled and re-encoded in the image worker pool, cached by content hash
+        base64_image = await image_pipeline.encode(image_path)
         
         messages = [
-            {"role": "system", "content": "\n".join(accident_assistant_system_message)},
+            {"role": "system", "content": prompt_registry.text("road-safety")},
             *history,
             {
                 "role": "user", 
@@ -77,37 +72,36 @@ class ModelInit:
         }
 
         logger.info(f"Sending image request to model: {query}")
-        async for chunk in self._stream_response(payload, url, headers):
+        async for chunk in self._stream_response(payload, key=conversation_id):
             yield chunk
     
     async def _stream_response(
         self, 
         payload: dict, 
-        url: str, 
-        headers: dict
+        endpoint: str = "chat",
+        key: str = None
     ) -> AsyncGenerator[str, None]:
         """Handle the streaming response from the model"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=payload, headers=headers) as response:
-                    if response.status == 200:
-                        async for line in response.content:
-                            if line:
-                                try:
-                                    data = json.loads(line)
-                                    if "message" in data:
-                                        content = data["message"].get("content", "")
-                                        if content:
-                                            # Format each character as a separate JSON response
-                                            for char in content:
-                                                yield f"data: {json.dumps({'content': char})}\n\n"
-                                except json.JSONDecodeError:
-                                    logger.warning(f"Failed to decode JSON: {line}")
-                                    continue
-                    else:
-                        error = await response.text()
-                        logger.error(f"Model API error: {error}")
-                        yield f"data: {json.dumps({'error': f'Model API returned status {response.status}'})}\n\n"
+            # Every generation waits for a model scheduler slot; tokens are
+            # coalesced into SSE frames per the endpoint's settings
+            model = model_router.route(payload, endpoint)
+            async with model_scheduler.slot(endpoint) as slot:
+                tokens = observe_stream(
+                    stream_tokens(self.client, payload, endpoint, slot, key=key), endpoint, model,
+                    on_ttft=lambda seconds: model_router.observe_ttft(payload["model"], seconds),
+                )
+                async for frame in encode_sse(tokens, endpoint):
+                    yield frame
+        except SchedulerBusy as e:
+            logger.warning(f"Model scheduler busy: {e.detail}")
+            yield f"data: {json.dumps({'error': e.detail, 'retry_after': e.retry_after})}\n\n"
+        except Preempted as e:
+            logger.warning(str(e))
+            yield f"data: {json.dumps({'error': str(e), 'preempted': True})}\n\n"
+        except OllamaError as e:
+            logger.error(f"Model API error: {e.detail}")
+            yield f"data: {json.dumps({'error': f'Model API returned status {e.status}'})}\n\n"
         except Exception as e:
             logger.error(f"Streaming error: {str(e)}")
             yield f"data: {json.dumps({'error': str(e)})}\n\n"
\ No newline at end of file
@@ -1,137 +1,56 @@
-import base64
+import asyncio
 import json
-from typing import Dict, Generator, List
-
-import requests
-from brain.search_engine import SearXNGSearch
-from configs.response_rules import (
-    search_response_context,
-    system_message,
-    search_message,
-    voice_message_rule,
-    health_assistant_system_message,
-    accident_assistant_system_message
-)
-from db.getdb import get_db
-from db.models import Conversation
+import logging
+import os
+import re
+from typing import AsyncGenerator, Dict, List, Optional
+
+import aiohttp
+from brain.conversation_state import conversation_states
+from brain.generation import stream_tokens
+from brain.image_pipeline import image_pipeline
+from brain.ollama_client import OLLAMA_MODEL, OllamaError, ollama_client
+from brain.search_engine import searx_client
+from brain.metrics import observe_stream, span
+from brain.model_router import model_router
+from brain.response_cache import response_cache
+from brain.retrieval import format_passage, pack_context
+from brain.scheduler import Preempted, SchedulerBusy, model_scheduler
+from brain.single_flight import single_flight
+from brain.sse import encode_sse, replay_sse
+from configs.prompt_registry import prompt_registry
+from configs.response_rules import search_message
+
+logger = logging.getLogger(__name__)
+# Categories SearXNG understands; anything else the model suggests is ignored
+SEARXNG_CATEGORIES = {"general", "news", "science", "it", "images", "videos", "map", "music", "files", "social media"}
+# Speculative search: enough raw-prompt results to start answering, and how long
+# to wait for the rewritten query's results once we have them
+SPECULATIVE_MIN_RESULTS = int(os.getenv("SPECULATIVE_MIN_RESULTS", "3"))
+SPECULATIVE_GRACE_SECONDS = float(os.getenv("SPECULATIVE_GRACE_SECONDS", "0.5"))
+
+
+def describe_payload(data: Dict) -> str:
+    """Compact payload for debug logs, with each image replaced by its size."""
+    messages = [
+        dict(m, images=[f"<{len(image)} base64 chars>" for image in m["images"]]) if m.get("images") else m
+        for m in data.get("messages", [])
+    ]
+    return json.dumps(dict(data, messages=messages) if messages else data)
 
 
 class ChatModel:
-    def __init__(self):
-        self.model = "gemma3:4b"  # or your preferred model name
-        self.base_url = "http://localhost:11434/api"
-        self.conversation_history = []
-        self.load_model()
-
-    def load_model(self):
-        try:
-            # Verify model is available
-            response = requests.get(f"{self.base_url}/tags")
-            if response.status_code == 200:
-                models = response.json().get("models", [])
-                if not any(m["name"] == self.model for m in models):
-                    raise Exception(f"Model {self.model} not found")
-            return True
-        except Exception as e:
-            raise Exception(f"Failed to load model: {str(e)}")
-
-    def analyzeImage(self, prompt: str, image_path: List[str], history: List[Dict]):
-        try:
-            # Open image in base64 format
-            image_base64 = []
-            for image in image_path:
-                with open(image, "rb") as image_file:
-                    image_base64.append(base64.b64encode(image_file.read()).decode("utf-8"))
-
-            # Build the prompt in the correct format for Ollama vision models
-            data = {
-                "model": self.model,
-                "messages": [
-                    {"role": "user", "content": prompt, "images": image_base64}
-                ],
-                "stream": True,
-            }
-
-            print(f"Sending request to Ollama with data: {json.dumps(data, indent=2)}")
-
-            # Send the request to Ollama
-            response = requests.post(f"{self.base_url}/chat", json=data, stream=True)
-            response.raise_for_status()
-
-            # Process the response
-            full_response = ""
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line.decode("utf-8"))
-                        if "message" in chunk:
-                            content = chunk["message"].get("content", "")
-                            print(content, end="", flush=True)
-                            full_response += content
-                        if chunk.get("done", False):
-                            print()
-                            break
-                    except json.JSONDecodeError:
-                        print(f"Error decoding JSON: {line}")
-
-            return full_response
-
-        except FileNotFoundError:
-            print("Error: Image file not found")
-            return "Error: Image file not found"
-        except requests.exceptions.RequestException as e:
-            print(f"Error making request to Ollama: {e}")
-            return f"Error making request to Ollama: {str(e)}"
-        except Exception as e:
-            print(f"An unexpected error occurred: {e}")
-            return f"An unexpected error occurred: {str(e)}"
-
-    def format_search_results(self, results: List[Dict]) -> str:
-        """Format search results into a readable string."""
-        if not results:
-            return "No search results found."
-        
-        formatted = "\nSearch Results:\n"
-        formatted += "=" * 80 + "\n\n"
-        
-        for i, result in enumerate(results, 1):
-            formatted += f"Result {i}:\n"
-            formatted += "-" * 40 + "\n"
-            formatted += f"Title: {result['title']}\n\n"
-            formatted += f"Content: {result.get('body', result.get('content', 'No description'))}\n\n"
-            if 'link' in result:
-                formatted += f"Source: {result['link']}\n"
-            elif 'url' in result:
-                formatted += f"Source: {result['url']}\n"
-            formatted += f"Retrieved: {result['timestamp']}\n"
-            formatted += "-" * 40 + "\n\n"
-        
-        formatted += "=" * 80 + "\n"
-        return formatted
-
-    def analyzeText(self, prompt: str, user_id: int, history: List[Dict], is_search: bool = False):
-        try:
-            if is_search:
-                # Generate search query using the model
-                response = self.generate_query_prompt(prompt)
-                if not response or "response" not in response:
-                    raise Exception("Failed to generate search query")
-
-                # Extract the search query and categories from the model's response
-                search_query = response["response"]
-                try:
-                    parsed_response = json.loads(search_query)
-                    search_query = parsed_response.get("search_query", search_query)
-                    categories = parsed_response.get("categories", None)
-                except json.JSONDecodeError:
-                    categories = None
-
-                print(f"\nGenerated search query: {search_query}")
-                searx = SearXNGSearch()
-                search_results = searx.search(search_query)
-                if search_results:
-                    context = self.format_search_results(search_results)
-                    message = f"""Context from search:
+    def __init__(self, model: str = OLLAMA_MODEL):
+        # Construction is free: no network calls at import time. Availability is
+        # checked and the weights are loaded by the startup warm-up (brain/startup.py)
+        self.model = model
+        self.client = ollama_client
+
+    def _search_prompt(self, prompt: str, search_results: List[Dict]) -> str:
+        if not search_results:
+            return f"I couldn't find any relevant real-time information. Please answer based on your knowledge: {prompt}"
+        context = self.format_search_results(search_results, prompt)
+        return f"""Context from search:
 {context}
 
 Based on this information, please provide a detailed and accurate answer to: {prompt}
@@ -147,198 +66,183 @@ Please follow these guidelines:
 8. Provide complete answers - do not cut off mid-sentence.
 9. Include practical examples where relevant.
 10. End with a clear conclusion or next steps."""
-                else:
-                    message = f"I couldn't find any relevant real-time information. Please answer based on your knowledge: {prompt}"
 
-                # Add message to conversation history
-                self.conversation_history.append({"role": "user", "content": message})
+    def _parse_query_response(self, text: str):
+        """Pull search_query/categories out of the model's JSON (possibly fenced) reply."""
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        try:
+            parsed_response = json.loads(match.group(0) if match else text)
+        except json.JSONDecodeError:
+            return text.strip(), None
+        search_query = parsed_response.get("search_query") or text.strip()
+        categories = [
+            c.lower() for c in parsed_response.get("categories") or []
+            if isinstance(c, str) and c.lower() in SEARXNG_CATEGORIES
+        ]
+        return search_query, categories or None
+
+    def format_search_results(self, results: List[Dict], prompt: str = "") -> str:
+        """Rerank results against the prompt and pack the best snippets into the search token budget."""
+        if not results:
+            return "No search results found."
+        passages = pack_context(prompt, results)
+        return "\n".join(format_passage(i, result) for i, result in enumerate(passages, 1))
+    def _chat_options(self) -> Dict:
+        return {
+            "num_ctx": 8192,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "stop": ["<|", "|>", "<", ">", "thus", "therefore", "hence", "pat", "pati", "etc", "..."]
+        }
+
+    async def _stream_chat(
+        self, data: Dict, endpoint: str, collect: List[str] = None, key: Optional[str] = None
+    ) -> AsyncGenerator[str, None]:
+        """Stream an Ollama chat request as coalesced SSE frames through the shared async client.
+
+        The model is picked by the router, the generation holds a model scheduler
+        slot for its whole duration and ``key`` (the conversation id) keeps a
+        conversation on one backend.
+        """
+        model = model_router.route(data, endpoint)
+        async with model_scheduler.slot(endpoint) as slot:
+            tokens = observe_stream(
+                stream_tokens(self.client, data, endpoint, slot, collect, key), endpoint, model,
+                on_ttft=lambda seconds: model_router.observe_ttft(data["model"], seconds),
+            )
+            async for frame in encode_sse(tokens, endpoint):
+                yield frame
 
-            # Prepare the chat request with system message
-            data = {
-                "model": self.model,
-                "messages": [
-                    {"role": "system", "content": system_message["content"]},
-                    *self.conversation_history,
-                    {"role": "user", "content": prompt},
-                ],
-                "stream": True,
-                "options": {
-                    "num_ctx": 8192,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "stop": ["<|", "|>", "<", ">", "thus", "therefore", "hence", "pat", "pati", "etc", "..."],
-                },
-            }
+    def _scheduler_error(self, e: Exception) -> str:
+        if isinstance(e, SchedulerBusy):
+            return f"data: {json.dumps({'error': e.detail, 'retry_after': e.retry_after})}\n\n"
+        return f"data: {json.dumps({'error': str(e), 'preempted': True})}\n\n"
 
-            print(f"Sending request to Ollama with data: {json.dumps(data, indent=2)}")
-
-            # Send the request to Ollama
-            response = requests.post(f"{self.base_url}/chat", json=data, stream=True)
-            response.raise_for_status()
-
-            # Process the response
-            full_response = ""
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line.decode("utf-8"))
-                        if "message" in chunk:
-                            content = chunk["message"].get("content", "")
-                            print(content, end="", flush=True)
-                            full_response += content
-                        if chunk.get("done", False):
-                            print("\n")
-                            break
-                    except json.JSONDecodeError:
-                        print(f"Error decoding JSON: {line}")
-                        continue
-
-            # Add response to conversation history
-            if full_response.strip():
-                self.conversation_history.append({"role": "assistant", "content": full_response})
-            return full_response
+    def _flight_key(self, endpoint: str, system_prompt: str, prompt: str) -> str:
+        return response_cache.make_key(endpoint, system_prompt, prompt)
 
-        except Exception as e:
-            error_msg = f"Error in analyzeText: {str(e)}"
-            print(f"Error: {error_msg}")
-            return error_msg
-
-    def generate_query_prompt(self, prompt: str):
-        response = requests.post(
-            f"{self.base_url}/generate",
-            headers={"Content-Type": "application/json"},
-            json={"model": self.model, "prompt": search_message(prompt), "stream": False},
-        )
-        return response.json()
+    def is_voice_in_flight(self, prompt: str) -> bool:
+        return single_flight.in_flight(self._flight_key("voice", prompt_registry.text("voice"), prompt))
 
-    def format_search_results(self, results: List[Dict]) -> str:
-        if not results:
-            return "No search results found."
-        formatted = "\n".join(
-            f"- {result.get('title', 'No title')} ({result.get('url', 'No URL')})"
-            for result in results
-        )
-        return formatted
-    def quick_streamed_response(self, prompt: str) -> Generator[str, None, None]:
-   
-        try:
-            # Format the messages field as a list of dictionaries
-            messages = [
-                {"role": "system", "content": voice_message_rule},  # Add a system message if needed
-                {"role": "user", "content": prompt}  # User's prompt
-            ]
+    async def quick_streamed_response_async(self, prompt: str) -> AsyncGenerator[str, None]:
+        """Short spoken answer for /voice.
+
+        Identical prompts arriving while an answer is being generated share it.
+        """
+        key = self._flight_key("voice", prompt_registry.text("voice"), prompt)
+        async for frame in single_flight.stream(key, "voice", lambda: self._voice_stream(prompt)):
+            yield frame
 
-            # Prepare the request data
+    async def _voice_stream(self, prompt: str) -> AsyncGenerator[str, None]:
+        try:
             data = {
                 "model": self.model,
-                "messages": messages,
+                "messages": [
+                    {"role": "system", "content": prompt_registry.text("voice")},
+                    {"role": "user", "content": prompt}
+                ],
                 "stream": True,
-                "options": {
-                    "num_ctx": 8192,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "stop": ["<|", "|>", "<", ">", "thus", "therefore", "hence", "pat", "pati", "etc", "..."]
-                }
+                "options": self._chat_options()
             }
+            logger.info(f"Sending voice request to Ollama: {prompt}")
+            async for frame in self._stream_chat(data, "voice"):
+                yield frame
+
+        except (SchedulerBusy, Preempted) as e:
+            logger.warning(f"Error: {str(e)}")
+            yield self._scheduler_error(e)
+        except OllamaError as e:
+            error_msg = f"API request failed with status {e.status}: {e.detail}"
+            logger.error(f"Error: {error_msg}")
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+        except Exception as e:
+            error_msg = f"Error in chat response: {str(e)}"
+            logger.error(f"Error: {error_msg}")
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
 
-            print(f"Sending request to Ollama with data: {json.dumps(data, indent=2)}")
+    def _health_prompt(self, type: str) -> str:
+        return prompt_registry.text("health" if type == "health" else "road-safety")
 
-            # Make the request to Ollama
-            response = requests.post(
-                f"{self.base_url}/chat",
-                json=data,
-                stream=True
-            )
+    def is_health_cached(self, prompt: str, type: str) -> bool:
+        """True if the answer can be served without a new generation (cached or being generated)."""
+        system_prompt = self._health_prompt(type)
+        return (
+            response_cache.contains(response_cache.make_key(type, system_prompt, prompt))
+            or single_flight.in_flight(self._flight_key(type, system_prompt, prompt))
+        )
 
-            if response.status_code != 200:
-                error_msg = f"API request failed with status {response.status_code}: {response.text}"
-                print(f"Error: {error_msg}")
-                yield f"data: {json.dumps({'error': error_msg})}\n\n"
+    async def quick_streamed_health_async(
+        self,
+        prompt: str,
+        type: str,
+        use_cache: bool = True,
+        endpoint: str = None
+    ) -> AsyncGenerator[str, None]:
+        """Health / road-safety answer.
+
+        Completed answers are cached by endpoint, system message and normalized
+        prompt; a hit is replayed in the same SSE format without touching the model.
+        On a miss, concurrent identical requests share one generation.
+        ``endpoint`` selects the scheduler priority and stream settings (defaults to ``type``).
+        """
+        endpoint = endpoint or type
+        system_prompt = self._health_prompt(type)
+        cache_key = response_cache.make_key(type, system_prompt, prompt) if use_cache else None
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                for frame in replay_sse(cached, endpoint):
+                    yield frame
                 return
 
-            # Process the streaming response
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line)
-                        if "message" in chunk:
-                            content = chunk["message"].get("content", "")
-                            if content:
-                                yield f"data: {json.dumps({'content': content})}\n\n"
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding JSON: {e}")
-                        continue
+        key = self._flight_key(endpoint, system_prompt, prompt)
+        frames = single_flight.stream(
+            key, endpoint, lambda: self._health_stream(prompt, type, system_prompt, cache_key, endpoint)
+        )
+        async for frame in frames:
+            yield frame
 
-        except Exception as e:
-            error_msg = f"Error in chat response: {str(e)}"
-            print(f"Error: {error_msg}")
-            yield f"data: {json.dumps({'error': error_msg})}\n\n"
-    
-    def quick_streamed_health(self, prompt: str, type : str) -> Generator[str, None, None]:
-   
+    async def _health_stream(
+        self, prompt: str, type: str, system_prompt: str, cache_key: Optional[str], endpoint: str
+    ) -> AsyncGenerator[str, None]:
         try:
-            # Format the messages field as a list of dictionaries
-            messages = [
-                {"role": "system", "content": health_assistant_system_message if type == "health" else accident_assistant_system_message},  # Add a system message if needed
-                {"role": "user", "content": prompt}  # User's prompt
-            ]
-
-            # Prepare the request data
             data = {
                 "model": self.model,
-                "messages": messages,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
                 "stream": True,
-                "options": {
-                    "num_ctx": 8192,
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "stop": ["<|", "|>", "<", ">", "thus", "therefore", "hence", "pat", "pati", "etc", "..."]
-                }
+                "options": self._chat_options()
             }
-
-            print(f"Sending request to Ollama with data: {json.dumps(data, indent=2)}")
-
-            # Make the request to Ollama
-            response = requests.post(
-                f"{self.base_url}/chat",
-                json=data,
-                stream=True
-            )
-
-            if response.status_code != 200:
-                error_msg = f"API request failed with status {response.status_code}: {response.text}"
-                print(f"Error: {error_msg}")
-                yield f"data: {json.dumps({'error': error_msg})}\n\n"
-                return
-
-            # Process the streaming response
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line)
-                        if "message" in chunk:
-                            content = chunk["message"].get("content", "")
-                            if content:
-                                yield f"data: {json.dumps({'content': content})}\n\n"
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding JSON: {e}")
-                        continue
-
+            logger.info(f"Sending {type} request to Ollama: {prompt[:80]}")
+            answer = []
+
+            async for frame in self._stream_chat(data, endpoint, answer):
+                yield frame
+
+            # Only complete, error-free answers are cached: a failed or truncated stream raises above
+            if cache_key and answer:
+                response_cache.put(cache_key, "".join(answer))
+
+        except (SchedulerBusy, Preempted) as e:
+            logger.warning(f"Error: {str(e)}")
+            yield self._scheduler_error(e)
+        except OllamaError as e:
+            error_msg = f"API request failed with status {e.status}: {e.detail}"
+            logger.error(f"Error: {error_msg}")
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
         except Exception as e:
             error_msg = f"Error in chat response: {str(e)}"
-            print(f"Error: {error_msg}")
+            logger.error(f"Error: {error_msg}")
             yield f"data: {json.dumps({'error': error_msg})}\n\n"
-            
 
-    def analyzeImageStream(self, prompt: str, image_path: List[str], history: List[Dict]) -> Generator[str, None, None]:
+    async def analyzeImageStreamAsync(self, prompt: str, image_path: List[str], history: List[Dict]) -> AsyncGenerator[str, None]:
+        """Image analysis for /analyze-report."""
         try:
-            # Open image in base64 format
-            image_base64 = []
-            for image in image_path:
-                with open(image, "rb") as image_file:
-                    image_base64.append(base64.b64encode(image_file.read()).decode("utf-8"))
+            # Decoding, resizing and encoding run in the image worker pool, off the event loop
+            image_base64 = await image_pipeline.encode_many(image_path)
 
-            # Build the prompt in the correct format for Ollama vision models
             data = {
                 "model": self.model,
                 "messages": [
@@ -346,35 +250,138 @@ Please follow these guidelines:
                 ],
                 "stream": True,
             }
-
-            print(f"Sending request to Ollama with data: {json.dumps(data, indent=2)}")
-
-            # Send the request to Ollama
-            response = requests.post(f"{self.base_url}/chat", json=data, stream=True)
-            response.raise_for_status()
-
-            # Process the streaming response
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        chunk = json.loads(line.decode("utf-8"))
-                        if "message" in chunk:
-                            content = chunk["message"].get("content", "")
-                            if content:
-                                yield f"data: {json.dumps({'content': content})}\n\n"
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding JSON: {e}")
-                        continue
+            logger.info(f"Sending image request to Ollama with {len(image_base64)} image(s)")
+            async for frame in self._stream_chat(data, "report"):
+                yield frame
 
         except FileNotFoundError:
             error_msg = "Error: Image file not found"
-            print(error_msg)
+            logger.error(error_msg)
             yield f"data: {json.dumps({'error': error_msg})}\n\n"
-        except requests.exceptions.RequestException as e:
+        except (SchedulerBusy, Preempted) as e:
+            logger.warning(f"Error: {str(e)}")
+            yield self._scheduler_error(e)
+        except (OllamaError, aiohttp.ClientError) as e:
             error_msg = f"Error making request to Ollama: {str(e)}"
-            print(error_msg)
+            logger.error(error_msg)
             yield f"data: {json.dumps({'error': error_msg})}\n\n"
         except Exception as e:
             error_msg = f"An unexpected error occurred: {str(e)}"
-            print(error_msg)
-            yield f"data: {json.dumps({'error': error_msg})}\n\n"
\ No newline at end of file
+            logger.error(error_msg)
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+
+    async def _generate_query_async(self, prompt: str):
+        data = {
+            "model": model_router.small if model_router.small_ready else self.model,
+            "prompt": search_message(prompt),
+            "stream": False,
+        }
+        async with model_scheduler.slot("chat"):
+            try:
+                response = await self.client.post("generate", data)
+            except OllamaError as e:
+                if not model_router.fall_back(data, e, "chat"):
+                    raise
+                response = await self.client.post("generate", data)
+        search_query, categories = self._parse_query_response(response.get("response", ""))
+        logger.info(f"Generated search query: {search_query}")
+        return search_query, categories
+
+    async def _rewritten_search(self, prompt: str) -> List[Dict]:
+        with span("query_generation", "chat"):
+            search_query, categories = await self._generate_query_async(prompt)
+        with span("search_rewritten", "chat"):
+            return await searx_client.search(search_query, categories=categories)
+
+    def _merge_results(self, *result_lists: List[Dict]) -> List[Dict]:
+        merged = []
+        seen_urls = set()
+        for results in result_lists:
+            for result in results:
+                if result.get("url") in seen_urls:
+                    continue
+                seen_urls.add(result.get("url"))
+                merged.append(result)
+        return merged
+
+    async def _speculative_search(self, prompt: str) -> List[Dict]:
+        """Search the raw prompt while the model rewrites the query, then merge.
+
+        If the raw search already returns enough results, the rewritten search
+        only gets a short grace period, so the LLM round-trip is off the
+        critical path; otherwise we wait for it.
+        """
+        raw_search = asyncio.create_task(searx_client.search(prompt))
+        rewritten = asyncio.create_task(self._rewritten_search(prompt))
+        try:
+            raw_results = await raw_search
+            timeout = SPECULATIVE_GRACE_SECONDS if len(raw_results) >= SPECULATIVE_MIN_RESULTS else None
+            done, _ = await asyncio.wait({rewritten}, timeout=timeout)
+            rewritten_results = []
+            if rewritten in done:
+                try:
+                    rewritten_results = rewritten.result()
+                except Exception as e:
+                    logger.warning(f"Rewritten search failed: {e}")
+            else:
+                logger.info("Answering from raw-prompt search results, rewritten query still pending")
+            return self._merge_results(rewritten_results, raw_results)
+        finally:
+            if not rewritten.done():
+                rewritten.cancel()
+
+    async def analyzeTextStream(
+        self,
+        prompt: str,
+        user_id: int,
+        history: Optional[List[Dict]] = None,
+        is_search: bool = False,
+        conversation_id: str = None,
+        speculative: bool = True
+    ) -> AsyncGenerator[str, None]:
+        """Chat answer, with optional web search.
+
+        ``history`` is used when given (e.g. the fitted context from /chat, which
+        persists turns itself), otherwise the per-conversation in-memory state.
+        """
+        try:
+            conversation_history = history if history is not None else conversation_states.get_messages(user_id, conversation_id)
+            search_context = []
+            if is_search:
+                with span("search", "chat"):
+                    if speculative:
+                        search_results = await self._speculative_search(prompt)
+                    else:
+                        search_results = await self._rewritten_search(prompt)
+                search_context.append({"role": "user", "content": self._search_prompt(prompt, search_results)})
+
+            data = {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": prompt_registry.text("chat")},
+                    *conversation_history,
+                    *search_context,
+                    {"role": "user", "content": prompt},
+                ],
+                "stream": True,
+                "options": self._chat_options(),
+            }
+            answer = []
+            async for frame in self._stream_chat(data, "chat", answer, key=conversation_id):
+                yield frame
+
+            if history is None and answer:
+                conversation_states.append(user_id, conversation_id, {"role": "user", "content": prompt})
+                conversation_states.append(user_id, conversation_id, {"role": "assistant", "content": "".join(answer)})
+
+        except (SchedulerBusy, Preempted) as e:
+            logger.warning(f"Error: {str(e)}")
+            yield self._scheduler_error(e)
+        except Exception as e:
+            error_msg = f"Error in analyzeText: {str(e)}"
+            logger.error(f"Error: {error_msg}")
+            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+
+
+# Shared instance used by every route
+chat_model = ChatModel()
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import os
+import time
+import threading
+from typing import Dict, List, Optional
+
+from brain.metrics import model_route_total
+from brain.ollama_client import OLLAMA_MODEL
+from brain.scheduler import model_scheduler
+from brain.startup import MODEL_WARMUP_TIMEOUT
+from configs.prompt_registry import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "1") != "0"
+# Text-only, used for short answers and as the overload fallback
+OLLAMA_SMALL_MODEL = os.getenv("OLLAMA_SMALL_MODEL", "gemma3:1b")
+# Road-safety prompts up to this many tokens count as short tips
+SHORT_PROMPT_TOKENS = int(os.getenv("MODEL_SHORT_PROMPT_TOKENS", "48"))
+
+# Context window per model. Fixed per model on purpose: Ollama reloads the
+# weights whenever num_ctx changes between requests
+MODEL_NUM_CTX: Dict[str, int] = {
+    OLLAMA_MODEL: int(os.getenv("OLLAMA_NUM_CTX", "8192")),
+    OLLAMA_SMALL_MODEL: int(os.getenv("OLLAMA_SMALL_NUM_CTX", "4096")),
+}
+
+# Time-to-first-token objective per endpoint, queue wait included
+TTFT_SLO_SECONDS: Dict[str, float] = {
+    "report": float(os.getenv("MODEL_SLO_REPORT", "4")),
+    "health": float(os.getenv("MODEL_SLO_HEALTH", "3")),
+    "road-safety": float(os.getenv("MODEL_SLO_ROAD_SAFETY", "3")),
+    "voice": float(os.getenv("MODEL_SLO_VOICE", "1.5")),
+    "chat": float(os.getenv("MODEL_SLO_CHAT", "5")),
+}
+
+# Endpoints served by the small model by default
+SMALL_ENDPOINTS = {"voice"}
+# Optional answer length cap per endpoint (num_predict), off unless set, e.g.
+# MODEL_MAX_ANSWER_TOKENS_VOICE=256. A capped answer stops mid-sentence.
+MAX_ANSWER_TOKENS: Dict[str, int] = {
+    endpoint: int(os.getenv(f"MODEL_MAX_ANSWER_TOKENS_{endpoint.upper().replace('-', '_')}", "0"))
+    for endpoint in TTFT_SLO_SECONDS
+}
+
+
+class ModelRouter:
+    """Picks the model and its options for every generation.
+
+    Voice and short road-safety tips go to the small model, everything else
+    (reports, images, chat, health) to the large one. When the large model's
+    expected time to first token (scheduler wait plus its recent TTFT) would
+    breach the endpoint's SLO and the small model's would not, text requests
+    fall back to the small model. Images and prompts that do not fit the small
+    model's context always stay on the large model, and nothing goes to the
+    small model until Ollama has confirmed it is installed.
+    """
+
+    def __init__(self, large: str = OLLAMA_MODEL, small: str = OLLAMA_SMALL_MODEL, enabled: bool = MODEL_ROUTING):
+        self.large = large
+        self.small = small
+        self.enabled = enabled and small != large
+        self._ttft: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # None until /api/tags has been checked (see ``discover``)
+        self.small_available: Optional[bool] = None
+
+    @property
+    def small_ready(self) -> bool:
+        return self.enabled and bool(self.small_available)
+
+    def models(self) -> List[str]:
+        return [self.large, self.small] if self.enabled else [self.large]
+
+    def load_options(self, model: str) -> Dict:
+        """Options that must match on every request to ``model`` to avoid a reload."""
+        return {"num_ctx": MODEL_NUM_CTX[model]} if model in MODEL_NUM_CTX else {}
+
+    def observe_ttft(self, model: str, seconds: float):
+        with self._lock:
+            previous = self._ttft.get(model)
+            self._ttft[model] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def model_ttft(self, model: str) -> float:
+        large = self._ttft.get(self.large, 0.0)
+        if model == self.small:
+            # Until the small model has been seen it is assumed no faster than the large one
+            return self._ttft.get(self.small, large)
+        return large
+
+    def expected_ttft(self, model: str, endpoint: str) -> float:
+        # Both models wait in the same scheduler queue
+        return model_scheduler.estimated_wait(endpoint) + self.model_ttft(model)
+
+    async def discover(self, client, timeout: float = MODEL_WARMUP_TIMEOUT):
+        """Background task: check the small model is installed before routing anything to it."""
+        started = time.perf_counter()
+        delay = 1.0
+        while self.enabled and self.small_available is None:
+            try:
+                self.small_available = await client.has_model(self.small)
+                if self.small_available:
+                    logger.info(f"Model routing enabled: {self.large} + {self.small}")
+                else:
+                    logger.warning(f"Model {self.small} not found in Ollama, routing everything to {self.large}")
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if time.perf_counter() - started + delay > timeout:
+                    logger.error(f"Could not check for model {self.small}, routing everything to {self.large}: {e}")
+                    return
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    def fall_back(self, data: Dict, error: Exception, endpoint: str) -> bool:
+        """Switch a payload that Ollama rejected with 404 (model missing) from the small to the large model.
+
+        Returns False if the error is anything else; the caller then re-raises it.
+        """
+        if getattr(error, "status", None) != 404 or data.get("model") != self.small or self.small == self.large:
+            return False
+        logger.error(f"Model {self.small} not found in Ollama, routing everything to {self.large}")
+        self.small_available = False
+        self._set_model(data, self.large, endpoint)
+        model_route_total.inc(endpoint, self.large, "small_missing")
+        return True
+
+    def _preferred(self, endpoint: str, prompt_tokens: int, context_tokens: int, has_images: bool) -> str:
+        if not self.small_ready or has_images or context_tokens >= MODEL_NUM_CTX.get(self.small, 0):
+            return self.large
+        if endpoint in SMALL_ENDPOINTS:
+            return self.small
+        if endpoint == "road-safety" and prompt_tokens <= SHORT_PROMPT_TOKENS:
+            return self.small
+        return self.large
+
+    def route(self, data: Dict, endpoint: str) -> str:
+        """Set ``model`` and options on an Ollama chat or generate payload in place; returns the model."""
+        messages = data.get("messages") or [{"role": "user", "content": data.get("prompt", "")}]
+        has_images = any(message.get("images") for message in messages)
+        user_prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        context_tokens = sum(estimate_tokens(m.get("content", "")) for m in messages)
+
+        if not self.enabled:
+            model, reason = self.large, "default"
+        else:
+            model = self._preferred(endpoint, estimate_tokens(user_prompt), context_tokens, has_images)
+            reason = "small" if model == self.small else "large"
+            slo = TTFT_SLO_SECONDS.get(endpoint)
+            if (
+                model == self.large
+                and self.small_ready
+                and not has_images
+                and slo is not None
+                and context_tokens < MODEL_NUM_CTX.get(self.small, 0)
+            ):
+                # Only worth it if the small model's own TTFT brings the request within the SLO;
+                # when the queue wait alone breaches it, switching models does not help
+                expected = self.expected_ttft(self.large, endpoint)
+                if expected > slo and self.expected_ttft(self.small, endpoint) <= slo:
+                    logger.info(f"{endpoint}: expected TTFT {expected:.1f}s > {slo:.1f}s SLO, using {self.small}")
+                    model, reason = self.small, "slo_fallback"
+
+        self._set_model(data, model, endpoint)
+        model_route_total.inc(endpoint, model, reason)
+        return model
+
+    def _set_model(self, data: Dict, model: str, endpoint: str):
+        data["model"] = model
+        options = dict(data.get("options") or {})
+        options.update(self.load_options(model))
+        if MAX_ANSWER_TOKENS.get(endpoint):
+            options.setdefault("num_predict", MAX_ANSWER_TOKENS[endpoint])
+        data["options"] = options
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "large": self.large,
+            "small": self.small,
+            "small_available": self.small_available,
+            "ttft_seconds": {model: round(seconds, 3) for model, seconds in self._ttft.items()},
+            "expected_ttft_seconds": {
+                endpoint: {model: round(self.expected_ttft(model, endpoint), 3) for model in self.models()}
+                for endpoint in TTFT_SLO_SECONDS
+            },
+            "slo_seconds": TTFT_SLO_SECONDS,
+        }
+
+
+model_router = ModelRouter()
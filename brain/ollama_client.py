@@ -0,0 +1,351 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from typing import AsyncGenerator, Dict, List, Optional, Sequence
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Connection settings, overridable from the environment
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/api")
+# Comma-separated pool of inference backends; defaults to the single OLLAMA_BASE_URL
+OLLAMA_BASE_URLS = [u.strip() for u in os.getenv("OLLAMA_BASE_URLS", OLLAMA_BASE_URL).split(",") if u.strip()]
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_MAX_CONNECTIONS_PER_HOST = int(os.getenv("OLLAMA_MAX_CONNECTIONS_PER_HOST", "32"))
+OLLAMA_KEEPALIVE_TIMEOUT = float(os.getenv("OLLAMA_KEEPALIVE_TIMEOUT", "60"))
+# Model used by every route, and how long Ollama keeps its weights loaded after a request
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# Backend pool health: active checks, ejection after repeated failures or when a
+# node is much slower than its peers, and how far a sticky conversation may
+# exceed the least loaded backend before it is routed elsewhere
+OLLAMA_HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "10"))
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "2"))
+OLLAMA_EJECT_FAILURES = int(os.getenv("OLLAMA_EJECT_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30"))
+OLLAMA_SLOW_FACTOR = float(os.getenv("OLLAMA_SLOW_FACTOR", "3"))
+OLLAMA_SLOW_MIN_SECONDS = float(os.getenv("OLLAMA_SLOW_MIN_SECONDS", "2"))
+OLLAMA_STICKY_SLACK = int(os.getenv("OLLAMA_STICKY_SLACK", "2"))
+
+
+class OllamaError(Exception):
+    """Raised when the Ollama API answers with a non-200 status."""
+
+    def __init__(self, status: int, detail: str):
+        super().__init__(f"Model API returned status {status}: {detail}")
+        self.status = status
+        self.detail = detail
+
+
+class Backend:
+    """One Ollama server in the pool, with its load and health bookkeeping."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.latency: Optional[float] = None  # EWMA seconds until response headers
+
+    def url(self, endpoint: str) -> str:
+        return f"{self.base_url}/{endpoint.lstrip('/')}"
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def eject(self, reason: str, seconds: float = OLLAMA_EJECT_SECONDS):
+        if self.available:
+            self.ejections += 1
+            logger.warning(f"Ejecting model backend {self.base_url} for {seconds:.0f}s: {reason}")
+        self.ejected_until = time.monotonic() + seconds
+
+    def stats(self) -> Dict:
+        return {
+            "available": self.available,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+            "latency_seconds": round(self.latency, 3) if self.latency is not None else None,
+        }
+
+
+class OllamaClient:
+    """Process-wide pooled HTTP client for the Ollama API.
+
+    The async session keeps connections alive between requests so token
+    streams do not pay TCP setup and session construction every time. It is
+    opened and closed with the FastAPI app lifecycle (see main.py).
+
+    Requests are spread over a pool of backends: a ``key`` (conversation id)
+    pins a conversation to one node so its prompt cache stays warm, anything
+    else goes to the node with the fewest outstanding requests. Failing or
+    much slower nodes are ejected for a while; a background task probes
+    every node's /api/tags.
+    """
+
+    def __init__(
+        self,
+        base_urls: Sequence[str] = OLLAMA_BASE_URLS,
+        connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+        read_timeout: float = OLLAMA_READ_TIMEOUT,
+        limit_per_host: int = OLLAMA_MAX_CONNECTIONS_PER_HOST,
+        keepalive_timeout: float = OLLAMA_KEEPALIVE_TIMEOUT,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+    ):
+        self.backends = [Backend(url) for url in (base_urls or [OLLAMA_BASE_URL])]
+        self.base_url = self.backends[0].base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.keep_alive = keep_alive
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    def url(self, endpoint: str, key: Optional[str] = None) -> str:
+        return self.pick(key).url(endpoint)
+
+    def pick(self, key: Optional[str] = None, exclude: Sequence[Backend] = ()) -> Backend:
+        """Backend for the next request: sticky by ``key`` when given, otherwise least outstanding."""
+        candidates = [b for b in self.backends if b.available and b not in exclude]
+        if not candidates:
+            # Everything is ejected: better to try the least bad node than fail outright
+            candidates = [b for b in self.backends if b not in exclude] or self.backends
+        least = min(candidates, key=lambda b: (b.outstanding, b.latency or 0.0, random.random()))
+        if key is None or len(candidates) == 1:
+            return least
+        # Rendezvous hashing: only conversations on a node that leaves the pool move
+        sticky = max(candidates, key=lambda b: hashlib.md5(f"{key}|{b.base_url}".encode()).digest())
+        if sticky.outstanding > least.outstanding + OLLAMA_STICKY_SLACK:
+            return least
+        return sticky
+
+    def _succeeded(self, backend: Backend, latency: float):
+        backend.consecutive_failures = 0
+        backend.latency = latency if backend.latency is None else 0.8 * backend.latency + 0.2 * latency
+        peers = [b.latency for b in self.backends if b is not backend and b.available and b.latency is not None]
+        if (
+            peers
+            and backend.latency > OLLAMA_SLOW_MIN_SECONDS
+            and backend.latency > OLLAMA_SLOW_FACTOR * min(peers)
+        ):
+            backend.eject(f"latency {backend.latency:.1f}s vs {min(peers):.1f}s on the best peer")
+            # Start from the peers' latency when it is readmitted
+            backend.latency = min(peers)
+
+    def _failed(self, backend: Backend, error: Exception):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= OLLAMA_EJECT_FAILURES:
+            backend.eject(f"{backend.consecutive_failures} consecutive failures ({error})")
+
+    def _retryable(self, error: Exception, backend: Backend, tried: List[Backend]) -> bool:
+        self._failed(backend, error)
+        return len(tried) < len(self.backends)
+
+    def with_keep_alive(self, payload: Dict) -> Dict:
+        """Ask Ollama to keep the model resident instead of unloading it after its default 5 minutes."""
+        if "model" in payload and "keep_alive" not in payload and self.keep_alive:
+            return dict(payload, keep_alive=self.keep_alive)
+        return payload
+
+    async def start(self):
+        """Open the shared async session (idempotent)."""
+        if self._session is not None and not self._session.closed:
+            return
+        self._loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            headers={"Content-Type": "application/json"},
+        )
+        if len(self.backends) > 1:
+            self._health_task = asyncio.create_task(self._health_loop())
+        logger.info(f"Ollama client started for {', '.join(b.base_url for b in self.backends)}")
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        # Lazily open the session when used outside the app lifecycle (scripts, tests);
+        # a session cannot be shared across event loops, so reopen if the loop changed
+        if self._session is not None and self._loop is not asyncio.get_running_loop():
+            self._session = None
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    async def stream(
+        self, endpoint: str, payload: Dict, key: Optional[str] = None, backend: Optional[Backend] = None
+    ) -> AsyncGenerator[Dict, None]:
+        """POST a streaming request and yield each decoded JSON line.
+
+        Connection errors and 5xx answers are retried on another backend as
+        long as nothing has been yielded yet.
+        """
+        session = await self.get_session()
+        payload = self.with_keep_alive(payload)
+        tried: List[Backend] = []
+        while True:
+            target = backend or self.pick(key, exclude=tried)
+            tried.append(target)
+            target.requests += 1
+            target.outstanding += 1
+            started = time.perf_counter()
+            yielded = False
+            try:
+                async with session.post(target.url(endpoint), json=payload) as response:
+                    if response.status != 200:
+                        raise OllamaError(response.status, await response.text())
+                    self._succeeded(target, time.perf_counter() - started)
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        try:
+                            data = json.loads(line)
+                        except json.JSONDecodeError:
+                            logger.warning(f"Failed to decode JSON: {line}")
+                            continue
+                        yielded = True
+                        yield data
+                return
+            except OllamaError as e:
+                if e.status < 500:
+                    raise
+                if backend is not None:
+                    self._failed(target, e)
+                    raise
+                if not self._retryable(e, target, tried):
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if yielded or backend is not None:
+                    self._failed(target, e)
+                    raise
+                if not self._retryable(e, target, tried):
+                    raise
+            finally:
+                target.outstanding -= 1
+
+    async def post(self, endpoint: str, payload: Dict, key: Optional[str] = None) -> Dict:
+        session = await self.get_session()
+        payload = self.with_keep_alive(payload)
+        tried: List[Backend] = []
+        while True:
+            target = self.pick(key, exclude=tried)
+            tried.append(target)
+            target.requests += 1
+            target.outstanding += 1
+            started = time.perf_counter()
+            try:
+                async with session.post(target.url(endpoint), json=payload) as response:
+                    if response.status != 200:
+                        raise OllamaError(response.status, await response.text())
+                    data = await response.json(content_type=None)
+                self._succeeded(target, time.perf_counter() - started)
+                return data
+            except OllamaError as e:
+                if e.status < 500 or not self._retryable(e, target, tried):
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not self._retryable(e, target, tried):
+                    raise
+            finally:
+                target.outstanding -= 1
+
+    async def get(self, endpoint: str, backend: Optional[Backend] = None, timeout: Optional[float] = None) -> Dict:
+        session = await self.get_session()
+        target = backend or self.pick()
+        request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+        async with session.get(target.url(endpoint), timeout=request_timeout) as response:
+            if response.status != 200:
+                raise OllamaError(response.status, await response.text())
+            return await response.json(content_type=None)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(OLLAMA_HEALTH_INTERVAL)
+            await asyncio.gather(*(self._check(backend) for backend in self.backends))
+
+    async def _check(self, backend: Backend):
+        try:
+            await self.get("tags", backend=backend, timeout=OLLAMA_HEALTH_TIMEOUT)
+        except Exception as e:
+            # Keeps an ejected node out until it answers again
+            backend.eject(f"health check failed ({str(e) or type(e).__name__})")
+            return
+        if not backend.available and backend.consecutive_failures >= OLLAMA_EJECT_FAILURES:
+            # Back online after a failure ejection; a slow node still waits out its ejection
+            backend.ejected_until = 0.0
+            backend.consecutive_failures = 0
+            logger.info(f"Model backend {backend.base_url} is healthy again")
+
+    def stats(self) -> Dict:
+        return {backend.base_url: backend.stats() for backend in self.backends}
+
+    async def has_model(self, model: str) -> bool:
+        models = (await self.get("tags")).get("models", [])
+        return any(m.get("name") == model for m in models)
+
+    async def warm_up(self, model: str, system: str = "", options: Optional[Dict] = None) -> float:
+        """Load ``model`` and prefill ``system`` on every backend with a one-token generation.
+
+        Ollama loads weights on the first request for a model, so without this
+        the first user pays the load time. ``keep_alive`` keeps them resident.
+        ``options`` must carry the same num_ctx as real requests, otherwise
+        Ollama reloads the model on the first one. Returns seconds taken by
+        the slowest backend.
+        """
+        started = time.perf_counter()
+        messages = [{"role": "user", "content": "Hi"}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "options": dict(options or {}, num_predict=1),
+        }
+
+        async def warm(backend: Backend):
+            async for _ in self.stream("chat", payload, backend=backend):
+                pass
+
+        results = await asyncio.gather(*(warm(backend) for backend in self.backends), return_exceptions=True)
+        errors = [(b, r) for b, r in zip(self.backends, results) if isinstance(r, Exception)]
+        if len(errors) == len(self.backends):
+            raise errors[0][1]
+        for backend, error in errors:
+            logger.warning(f"Warm-up failed on {backend.base_url}: {error}")
+        return time.perf_counter() - started
+
+
+# Shared instance used by every model call in the process
+ollama_client = OllamaClient()
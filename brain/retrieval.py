@@ -0,0 +1,118 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List
+
+from configs.prompt_registry import estimate_tokens
+
+SEARCH_CONTEXT_BUDGET = int(os.getenv("SEARCH_CONTEXT_BUDGET", "1200"))
+# Most passages packed, applied after reranking the full result list
+SEARCH_MAX_PASSAGES = int(os.getenv("SEARCH_MAX_PASSAGES", "10"))
+# Longest single snippet allowed into the prompt, in tokens
+MAX_PASSAGE_TOKENS = 200
+# Word-shingle Jaccard similarity above which two snippets count as duplicates
+NEAR_DUPLICATE_THRESHOLD = 0.7
+
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where",
+    "which", "who", "why", "with", "you", "your", "i", "do", "does", "can", "should",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [word for word in _WORD.findall(text.lower()) if word not in _STOPWORDS]
+
+
+def bm25_scores(query: str, documents: List[str], k1: float = 1.5, b: float = 0.75) -> List[float]:
+    """Okapi BM25 of each document against the query, using the result set as the corpus."""
+    query_terms = set(tokenize(query))
+    doc_terms = [tokenize(doc) for doc in documents]
+    if not query_terms or not doc_terms:
+        return [0.0] * len(documents)
+
+    n_docs = len(doc_terms)
+    avg_len = sum(len(terms) for terms in doc_terms) / n_docs or 1.0
+    doc_freq = Counter(term for terms in doc_terms for term in set(terms) if term in query_terms)
+
+    scores = []
+    for terms in doc_terms:
+        counts = Counter(terms)
+        score = 0.0
+        for term in query_terms:
+            tf = counts.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(terms) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = tokenize(text)
+    if len(words) < size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Cut on a word boundary at roughly four characters per token
+    cut = text[:max_tokens * 4].rsplit(" ", 1)[0]
+    return cut + " ..."
+
+
+def rank_results(query: str, results: List[Dict]) -> List[Dict]:
+    """Rerank search results by BM25 against the user prompt and drop near-duplicate snippets."""
+    documents = [f"{r.get('title', '')} {r.get('content', '')}" for r in results]
+    scores = bm25_scores(query, documents)
+    ranked = sorted(zip(scores, range(len(results))), key=lambda pair: (-pair[0], pair[1]))
+
+    kept = []
+    kept_shingles = []
+    for score, index in ranked:
+        shingles = _shingles(results[index].get("content", ""))
+        if any(_jaccard(shingles, other) >= NEAR_DUPLICATE_THRESHOLD for other in kept_shingles):
+            continue
+        kept.append(dict(results[index], relevance=round(score, 3)))
+        kept_shingles.append(shingles)
+    return kept
+
+
+def pack_context(query: str, results: List[Dict], budget: int = SEARCH_CONTEXT_BUDGET) -> List[Dict]:
+    """Best-first passages whose formatted size fits in ``budget`` tokens."""
+    ranked = rank_results(query, results)
+    # Results sharing no terms with the prompt only go in if nothing matched at all
+    if any(result["relevance"] > 0 for result in ranked):
+        ranked = [result for result in ranked if result["relevance"] > 0]
+
+    packed = []
+    used = 0
+    for result in ranked:
+        if len(packed) >= SEARCH_MAX_PASSAGES:
+            break
+        passage = dict(result, content=_truncate(result.get("content", ""), MAX_PASSAGE_TOKENS))
+        cost = estimate_tokens(format_passage(len(packed) + 1, passage))
+        if used + cost > budget:
+            continue
+        packed.append(passage)
+        used += cost
+    return packed
+
+
+def format_passage(number: int, result: Dict) -> str:
+    return (
+        f"[{number}] {result.get('title', 'No title')}\n"
+        f"Source: {result.get('url', 'No URL')}\n"
+        f"{result.get('content', '')}\n"
+    )
@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from typing import Dict, List, Optional
+
+from brain.metrics import record_span
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, lower value is served first
+EMERGENCY = 0
+HEALTH = 1
+VOICE = 2
+CHAT = 3
+
+ENDPOINT_PRIORITY: Dict[str, int] = {
+    "report": EMERGENCY,
+    "health": HEALTH,
+    "road-safety": HEALTH,
+    "voice": VOICE,
+    "chat": CHAT,
+}
+
+MODEL_MAX_IN_FLIGHT = int(os.getenv("MODEL_MAX_IN_FLIGHT", "4"))
+MODEL_MAX_QUEUE_TOTAL = int(os.getenv("MODEL_MAX_QUEUE_TOTAL", "64"))
+# Opt-in: an emergency report may cut off a running chat/voice answer (MODEL_PREEMPTION=1)
+MODEL_PREEMPTION = os.getenv("MODEL_PREEMPTION", "0") == "1"
+
+# Waiting requests allowed per priority class before new ones are rejected
+MAX_QUEUE_DEPTH: Dict[int, int] = {
+    EMERGENCY: int(os.getenv("MODEL_MAX_QUEUE_EMERGENCY", "32")),
+    HEALTH: int(os.getenv("MODEL_MAX_QUEUE_HEALTH", "24")),
+    VOICE: int(os.getenv("MODEL_MAX_QUEUE_VOICE", "16")),
+    CHAT: int(os.getenv("MODEL_MAX_QUEUE_CHAT", "16")),
+}
+
+
+class SchedulerBusy(Exception):
+    """The model queue is full; carries the HTTP status and Retry-After to send."""
+
+    def __init__(self, status_code: int, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class Preempted(Exception):
+    """A running low-priority generation was cancelled to make room for an emergency job."""
+
+
+class Slot:
+    """One admitted generation. Streams call ``raise_if_preempted`` between tokens."""
+
+    def __init__(self, scheduler: "ModelScheduler", endpoint: str):
+        self.scheduler = scheduler
+        self.endpoint = endpoint
+        self.priority = ENDPOINT_PRIORITY.get(endpoint, CHAT)
+        self.preempted = False
+        self.started_at = 0.0
+
+    def raise_if_preempted(self):
+        if self.preempted:
+            raise Preempted(f"{self.endpoint} generation preempted by an emergency request")
+
+    async def __aenter__(self) -> "Slot":
+        await self.scheduler._acquire(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler._release(self)
+        return False
+
+
+class ModelScheduler:
+    """Priority admission control in front of the local model.
+
+    At most ``max_in_flight`` generations run at once; the rest wait in a
+    priority queue (emergency report > health/road-safety > voice > chat).
+    Requests beyond the per-class queue depth are rejected right away so the
+    route can answer 429/503 with Retry-After instead of piling up.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = MODEL_MAX_IN_FLIGHT,
+        max_queue_depth: Optional[Dict[int, int]] = None,
+        max_queue_total: int = MODEL_MAX_QUEUE_TOTAL,
+        preemption: bool = MODEL_PREEMPTION,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = dict(max_queue_depth or MAX_QUEUE_DEPTH)
+        self.max_queue_total = max_queue_total
+        self.preemption = preemption
+        self._running: List[Slot] = []
+        self._waiting: list = []  # heap of (priority, seq, slot, future)
+        self._seq = itertools.count()
+        self._avg_duration = 10.0
+        self.admitted = 0
+        self.rejected = 0
+        self.preempted = 0
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        return sum(
+            1 for p, _, _, fut in self._waiting
+            if not fut.done() and (priority is None or p == priority)
+        )
+
+    def _retry_after(self) -> int:
+        backlog = self.queue_depth() + len(self._running)
+        return max(1, math.ceil(self._avg_duration * backlog / max(self.max_in_flight, 1)))
+
+    def estimated_wait(self, endpoint: str) -> float:
+        """Rough seconds a new ``endpoint`` request would wait for a slot right now."""
+        priority = ENDPOINT_PRIORITY.get(endpoint, CHAT)
+        ahead = sum(1 for p, _, _, fut in self._waiting if not fut.done() and p <= priority)
+        free = self.max_in_flight - len(self._running)
+        if ahead < free:
+            return 0.0
+        return self._avg_duration * (ahead - free + 1) / max(self.max_in_flight, 1)
+
+    def check_admission(self, endpoint: str):
+        """Raise SchedulerBusy if a new request for ``endpoint`` would be rejected."""
+        priority = ENDPOINT_PRIORITY.get(endpoint, CHAT)
+        if len(self._running) < self.max_in_flight and not self._waiting:
+            return
+        if self.queue_depth() >= self.max_queue_total:
+            self.rejected += 1
+            raise SchedulerBusy(503, self._retry_after(), "Model is overloaded, please retry later")
+        if self.queue_depth(priority) >= self.max_queue_depth.get(priority, 0):
+            self.rejected += 1
+            raise SchedulerBusy(429, self._retry_after(), f"Too many queued {endpoint} requests, please retry later")
+
+    def slot(self, endpoint: str) -> Slot:
+        return Slot(self, endpoint)
+
+    async def _acquire(self, slot: Slot):
+        if len(self._running) < self.max_in_flight and not any(
+            p <= slot.priority and not fut.done() for p, _, _, fut in self._waiting
+        ):
+            self._start(slot)
+            return
+
+        self.check_admission(slot.endpoint)
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (slot.priority, next(self._seq), slot, future))
+        if self.preemption and slot.priority == EMERGENCY:
+            self._preempt_for(slot)
+        queued_at = time.perf_counter()
+        try:
+            await future
+            record_span(slot.endpoint, "queue_wait", time.perf_counter() - queued_at)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was handed over just as we were cancelled, give it back
+                self._release(slot)
+            else:
+                future.cancel()
+            raise
+
+    def _start(self, slot: Slot):
+        slot.started_at = time.monotonic()
+        self._running.append(slot)
+        self.admitted += 1
+
+    def _release(self, slot: Slot):
+        if slot not in self._running:
+            return
+        self._running.remove(slot)
+        duration = time.monotonic() - slot.started_at
+        self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+        while self._waiting and len(self._running) < self.max_in_flight:
+            _, _, waiter, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            self._start(waiter)
+            future.set_result(None)
+
+    def _preempt_for(self, slot: Slot):
+        if len(self._running) < self.max_in_flight:
+            return
+        waiting_emergencies = self.queue_depth(EMERGENCY)
+        already_preempted = sum(1 for s in self._running if s.preempted)
+        if already_preempted >= waiting_emergencies:
+            return
+        victims = [s for s in self._running if s.priority > slot.priority and not s.preempted]
+        if not victims:
+            return
+        # Lowest priority first, newest first within a class (least work lost)
+        victim = max(victims, key=lambda s: (s.priority, s.started_at))
+        victim.preempted = True
+        self.preempted += 1
+        logger.warning(f"Preempting {victim.endpoint} generation for {slot.endpoint}")
+
+    def stats(self) -> Dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": len(self._running),
+            "queued": {
+                endpoint: self.queue_depth(priority)
+                for endpoint, priority in ENDPOINT_PRIORITY.items()
+                if endpoint != "road-safety"
+            },
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "preempted": self.preempted,
+            "avg_generation_seconds": round(self._avg_duration, 3),
+        }
+
+
+model_scheduler = ModelScheduler()
@@ -1,16 +1,25 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+import aiohttp
 import requests
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 import json
 import logging
 from urllib.parse import urlparse
+from brain.metrics import record_span
 
-# Set up logging
-logging.basicConfig(level=logging.DEBUG)
+# Logging is configured by the application (see main.py); never force DEBUG here
 logger = logging.getLogger(__name__)
 
+SEARXNG_BASE_URL = os.getenv("SEARXNG_BASE_URL", "http://localhost:8080")
+SEARXNG_CACHE_TTL = float(os.getenv("SEARXNG_CACHE_TTL", "600"))
+SEARXNG_CACHE_SIZE = int(os.getenv("SEARXNG_CACHE_SIZE", "1024"))
+
 class SearXNGSearch:
-    def __init__(self, base_url: str = "http://localhost:8080"):
+    def __init__(self, base_url: str = SEARXNG_BASE_URL):
         self.base_url = base_url.rstrip('/')
         self.search_endpoint = f"{self.base_url}/search"
         self.headers = {
@@ -42,6 +51,25 @@ class SearXNGSearch:
         except:
             return url
 
+    def _params(self, query: str, categories: Optional[List[str]] = None) -> Dict:
+        params = dict(self.data, q=query)
+        if categories:
+            params['categories'] = ','.join(categories)
+        return params
+
+    def _format_result(self, result: Dict, category: Optional[str] = None) -> Dict:
+        content = result.get('content', 'No description') or 'No description'
+        return {
+            'title': result.get('title', 'No title'),
+            'url': result.get('url', ''),
+            'content': ' '.join(content.split()),  # Remove extra whitespace
+            'source': result.get('engine', 'Unknown'),
+            'domain': self._extract_domain(result.get('url', '')),
+            'score': result.get('score', 0),
+            'category': category or result.get('category', 'general'),
+            'timestamp': datetime.now().isoformat()
+        }
+
     def search(self, query: str, num_results: int = 10, categories: List[str] = None) -> List[Dict]:
         """
         Perform a search using SearXNG.
@@ -57,14 +85,15 @@ class SearXNGSearch:
         try:
             logger.debug(f"Performing search for query: {query}")
             
-            # Update search parameters
-            self.data['q'] = query
+            # Per-call copy of the search parameters (the defaults are shared)
+            params = self._params(query, categories)
             
-            logger.debug(f"Search parameters: {self.data}")
+            logger.debug(f"Search parameters: {params}")
 
-            # Make the request
+            # Make the request, letting requests encode the query string
             response = requests.get(
-                f"{self.search_endpoint}?q={query}&format=json",
+                self.search_endpoint,
+                params=params,
                 headers=self.headers,
                 timeout=10
             )
@@ -75,7 +104,8 @@ class SearXNGSearch:
             
             # Parse JSON response
             data = response.json()
-            logger.debug(f"Received JSON response: {json.dumps(data, indent=2)}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Received JSON response: {json.dumps(data, indent=2)}")
             
             # Format the results
             formatted_results = []
@@ -96,19 +126,8 @@ class SearXNGSearch:
                         seen_domains.add(domain)
                         
                         # Clean and format the content
-                        content = result.get('content', 'No description')
-                        content = ' '.join(content.split())  # Remove extra whitespace
-                        
-                        formatted_result = {
-                            'title': result.get('title', 'No title'),
-                            'url': result.get('url', ''),
-                            'content': content,
-                            'source': result.get('engine', 'Unknown'),
-                            'domain': domain,
-                            'timestamp': datetime.now().isoformat()
-                        }
+                        formatted_result = self._format_result(result)
                         formatted_results.append(formatted_result)
-                        logger.debug(f"Found result: {formatted_result['title']}")
                     except Exception as e:
                         logger.error(f"Error parsing result: {e}")
                         continue
@@ -159,6 +178,173 @@ class SearXNGSearch:
         
         return formatted
 
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+class AsyncSearXNGSearch(SearXNGSearch):
+    """Pooled, caching async SearXNG client.
+
+    Results are cached (TTL + LRU) by normalized query and category set, and
+    concurrent identical searches share one upstream request. Searches over
+    several categories fan out one request per category in parallel and merge
+    the results by rank, dropping duplicate URLs. Several results from one
+    site are kept: choosing among them is left to the relevance rerank
+    (brain.retrieval), which also drops near-duplicate snippets.
+    """
+
+    def __init__(
+        self,
+        base_url: str = SEARXNG_BASE_URL,
+        cache_ttl: float = SEARXNG_CACHE_TTL,
+        cache_size: int = SEARXNG_CACHE_SIZE,
+        timeout: float = 10,
+        limit_per_host: int = 16,
+    ):
+        super().__init__(base_url)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.limit_per_host = limit_per_host
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._cache: "OrderedDict[Tuple, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._inflight: Dict[Tuple, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    async def start(self):
+        if self._session is not None and not self._session.closed:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit_per_host=self.limit_per_host),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            headers=self.headers,
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        if self._session is not None and self._loop is not asyncio.get_running_loop():
+            self._session = None
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    def _cache_get(self, key: Tuple) -> Optional[List[Dict]]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at < time.monotonic():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return results
+
+    def _cache_put(self, key: Tuple, results: List[Dict]):
+        self._cache[key] = (time.monotonic() + self.cache_ttl, results)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def search(self, query: str, num_results: Optional[int] = None, categories: List[str] = None) -> List[Dict]:
+        """All merged results by default: the caller reranks them (see brain.retrieval) and cuts after that."""
+        categories = sorted(set(categories or [self.data['categories']]))
+        key = (normalize_query(query), tuple(categories))
+
+        cached = self._cache_get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached[:num_results]
+
+        # Join an identical search that is already running
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._search_upstream(key, query, categories))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+
+        # The upstream search belongs to no single caller: one caller going away
+        # must not cancel it for the others, so it is only cancelled with the last
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            results = await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()
+        return results[:num_results]
+
+    async def _search_upstream(self, key: Tuple, query: str, categories: List[str]) -> List[Dict]:
+        try:
+            per_category = await asyncio.gather(
+                *(self._fetch(query, category) for category in categories)
+            )
+            results = self._merge(per_category)
+            if results:
+                self._cache_put(key, results)
+            return results
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+
+    async def _fetch(self, query: str, category: str) -> List[Dict]:
+        started = time.perf_counter()
+        try:
+            session = await self.get_session()
+            async with session.get(self.search_endpoint, params=self._params(query, [category])) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+            return [
+                self._format_result(result, category)
+                for result in data.get('results', [])
+            ]
+        except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+            logger.error(f"Error performing SearXNG search ({category}): {e}")
+            return []
+        finally:
+            record_span("chat", "searxng", time.perf_counter() - started)
+
+    def _merge(self, per_category: List[List[Dict]]) -> List[Dict]:
+        """Round-robin by rank across categories, skipping repeated URLs."""
+        merged = []
+        seen_urls = set()
+        for rank in range(max((len(results) for results in per_category), default=0)):
+            for results in per_category:
+                if rank >= len(results):
+                    continue
+                result = results[rank]
+                if result['url'] in seen_urls:
+                    continue
+                seen_urls.add(result['url'])
+                merged.append(result)
+        return merged
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
+
+
+# Shared instance, opened and closed with the app (see main.py)
+searx_client = AsyncSearXNGSearch()
+
 def main():
     # Example usage
     searx = SearXNGSearch()
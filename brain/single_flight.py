@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+from typing import AsyncGenerator, AsyncIterable, Callable, Dict, List, Optional
+
+from brain.metrics import single_flight_total
+from brain.sse import sse_frame
+
+logger = logging.getLogger(__name__)
+
+# Set SINGLE_FLIGHT=0 to give every request its own generation
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1") != "0"
+
+
+class Flight:
+    """One upstream generation and the SSE frames it has produced so far."""
+
+    def __init__(self, key: str, endpoint: str):
+        self.key = key
+        self.endpoint = endpoint
+        self.frames: List[str] = []
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._event = asyncio.Event()
+
+    def publish(self, frame: str):
+        self.frames.append(frame)
+        # Wake everyone waiting on the current event and give later waiters a fresh one
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    def finish(self):
+        self.done = True
+        self._event.set()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """Everything produced so far (replay), then new frames as they arrive (live)."""
+        index = 0
+        while True:
+            while index < len(self.frames):
+                frame = self.frames[index]
+                index += 1
+                yield frame
+            if self.done:
+                return
+            await self._event.wait()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent generations into one upstream stream.
+
+    The first request for a key starts the generation in a background task;
+    requests arriving while it runs subscribe to it and receive the frames
+    already sent followed by the live ones. The generation is not tied to any
+    one client: it keeps going while at least one subscriber is connected and
+    is cancelled when the last one leaves.
+    """
+
+    def __init__(self, enabled: bool = SINGLE_FLIGHT):
+        self.enabled = enabled
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.joined = 0
+        self.abandoned = 0
+
+    def in_flight(self, key: str) -> bool:
+        return self.enabled and key in self._flights
+
+    async def _run(self, flight: Flight, frames: AsyncIterable[str]):
+        try:
+            async for frame in frames:
+                flight.publish(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Shared {flight.endpoint} generation failed: {str(e)}")
+            flight.publish(sse_frame({"error": str(e)}))
+        finally:
+            flight.finish()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    async def stream(
+        self, key: str, endpoint: str, produce: Callable[[], AsyncIterable[str]]
+    ) -> AsyncGenerator[str, None]:
+        """Frames of the generation for ``key``, starting ``produce()`` only if none is running."""
+        if not self.enabled:
+            async for frame in produce():
+                yield frame
+            return
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key, endpoint)
+            self._flights[key] = flight
+            flight.task = asyncio.ensure_future(self._run(flight, produce()))
+            self.started += 1
+            single_flight_total.inc(endpoint, "leader")
+        else:
+            self.joined += 1
+            single_flight_total.inc(endpoint, "joined")
+
+        flight.subscribers += 1
+        try:
+            async for frame in flight.subscribe():
+                yield frame
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more; free the model
+                self.abandoned += 1
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "subscribers": sum(flight.subscribers for flight in self._flights.values()),
+            "started": self.started,
+            "joined": self.joined,
+            "abandoned": self.abandoned,
+        }
+
+
+single_flight = SingleFlight()
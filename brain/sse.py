@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncGenerator, AsyncIterable, Dict
+
+from brain.metrics import client_disconnects_total
+
+logger = logging.getLogger(__name__)
+
+# Set SSE_COALESCE=0 to emit one frame per upstream token (useful for before/after comparisons)
+SSE_COALESCE = os.getenv("SSE_COALESCE", "1") != "0"
+
+WORD_BOUNDARIES = (" ", "\n", "\t", ".", ",", "!", "?", ";", ":")
+
+
+class StreamSettings:
+    """When to flush buffered tokens into a single SSE frame.
+
+    A frame is written as soon as any limit is hit: ``max_delay`` seconds since
+    the first buffered token, ``max_bytes`` of buffered content, or (with
+    ``flush_on_word``) the buffer ending on a word boundary.
+    """
+
+    def __init__(self, max_delay: float, max_bytes: int, flush_on_word: bool = False):
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.flush_on_word = flush_on_word
+
+
+# Per-endpoint coalescing: voice wants words out quickly, chat can batch more
+STREAM_SETTINGS: Dict[str, StreamSettings] = {
+    "voice": StreamSettings(max_delay=0.03, max_bytes=64, flush_on_word=True),
+    "chat": StreamSettings(max_delay=0.1, max_bytes=512),
+    "health": StreamSettings(max_delay=0.08, max_bytes=384),
+    "road-safety": StreamSettings(max_delay=0.08, max_bytes=384),
+    "report": StreamSettings(max_delay=0.1, max_bytes=512),
+}
+
+
+class StreamStats:
+    """Running SSE output counters for one endpoint."""
+
+    def __init__(self):
+        self.streams = 0
+        self.tokens = 0
+        self.frames = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def snapshot(self) -> Dict:
+        seconds = self.seconds or 1e-9
+        return {
+            "streams": self.streams,
+            "tokens": self.tokens,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "stream_seconds": round(self.seconds, 3),
+            "frames_per_sec": round(self.frames / seconds, 2),
+            "bytes_per_sec": round(self.bytes / seconds, 2),
+            "tokens_per_frame": round(self.tokens / self.frames, 2) if self.frames else 0.0,
+        }
+
+
+stream_stats: Dict[str, StreamStats] = {}
+
+
+def get_stream_stats() -> Dict[str, Dict]:
+    return {endpoint: stats.snapshot() for endpoint, stats in stream_stats.items()}
+
+
+def sse_frame(payload: Dict) -> str:
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def encode_sse(tokens: AsyncIterable[str], endpoint: str) -> AsyncGenerator[str, None]:
+    """Coalesce a token stream into ``data: {"content": ...}`` SSE frames.
+
+    The frame format is unchanged from the per-token encoding, so clients that
+    concatenate ``content`` see the same text. Buffered text is flushed before
+    an upstream error is re-raised.
+    """
+    settings = STREAM_SETTINGS.get(endpoint, STREAM_SETTINGS["chat"])
+    stats = stream_stats.setdefault(endpoint, StreamStats())
+    stats.streams += 1
+    started = time.perf_counter()
+
+    iterator = tokens.__aiter__()
+    buffer = []
+    buffered_bytes = 0
+    first_buffered_at = 0.0
+    pending = None
+
+    def flush() -> str:
+        nonlocal buffer, buffered_bytes
+        frame = sse_frame({"content": "".join(buffer)})
+        buffer = []
+        buffered_bytes = 0
+        stats.frames += 1
+        stats.bytes += len(frame)
+        return frame
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            if buffer and SSE_COALESCE:
+                # Wait for the next token only until the time window closes
+                remaining = settings.max_delay - (time.perf_counter() - first_buffered_at)
+                if remaining > 0:
+                    await asyncio.wait({pending}, timeout=remaining)
+                if not pending.done():
+                    yield flush()
+                    continue
+
+            try:
+                token = await pending
+            except StopAsyncIteration:
+                break
+            finally:
+                if pending.done():
+                    pending = None
+
+            if not token:
+                continue
+            stats.tokens += 1
+            if not buffer:
+                first_buffered_at = time.perf_counter()
+            buffer.append(token)
+            buffered_bytes += len(token.encode("utf-8"))
+
+            if (
+                not SSE_COALESCE
+                or buffered_bytes >= settings.max_bytes
+                or (settings.flush_on_word and token.endswith(WORD_BOUNDARIES))
+            ):
+                yield flush()
+
+        if buffer:
+            yield flush()
+    except Exception:
+        if buffer:
+            yield flush()
+        raise
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            await asyncio.gather(pending, return_exceptions=True)
+        aclose = getattr(iterator, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        stats.seconds += time.perf_counter() - started
+
+
+def replay_sse(text: str, endpoint: str):
+    """Re-emit a stored answer in the same frame format a live stream would use."""
+    settings = STREAM_SETTINGS.get(endpoint, STREAM_SETTINGS["chat"])
+    stats = stream_stats.setdefault(endpoint, StreamStats())
+    step = max(settings.max_bytes, 1)
+    for start in range(0, len(text), step):
+        frame = sse_frame({"content": text[start:start + step]})
+        stats.frames += 1
+        stats.bytes += len(frame)
+        yield frame
+
+
+# Cleanup tasks of abandoned streams, referenced so they are not garbage collected mid-run
+_closing = set()
+
+
+async def _wait_for_disconnect(request):
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _close_abandoned(pending, iterator):
+    # Runs in its own task: the request task may be inside a cancelled scope
+    # where every await is interrupted again, which would cut the cleanup short
+    if pending is not None:
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception as e:
+            logger.warning(f"Error closing abandoned stream: {e}")
+
+
+async def cancel_on_disconnect(request, frames: AsyncIterable[str], route: str) -> AsyncGenerator[str, None]:
+    """Relay SSE frames until the client goes away, then abort the producer at once.
+
+    The producer is advanced in a separate task and raced against the
+    request's ``http.disconnect``, so a dropped client is noticed even while
+    the request is queued or the model is still prefilling. Cancelling the
+    producer unwinds its upstream Ollama request, closing that connection so
+    Ollama stops generating; producers persist partial output on the way out.
+    """
+    iterator = frames.__aiter__()
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    pending = None
+    finished = False
+    try:
+        while True:
+            pending = asyncio.ensure_future(iterator.__anext__())
+            await asyncio.wait({pending, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not pending.done():
+                logger.info(f"Client disconnected from {route} stream, cancelling generation")
+                client_disconnects_total.inc(route)
+                break
+            try:
+                frame = pending.result()
+            except StopAsyncIteration:
+                finished = True
+                break
+            pending = None
+            yield frame
+    except (asyncio.CancelledError, GeneratorExit):
+        # The server noticed the disconnect first (or is shutting down)
+        client_disconnects_total.inc(route)
+        raise
+    finally:
+        watcher.cancel()
+        if not finished:
+            task = asyncio.ensure_future(_close_abandoned(pending, iterator))
+            _closing.add(task)
+            task.add_done_callback(_closing.discard)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") != "0"
+# Ollama may still be starting when the app boots; keep retrying this long
+MODEL_WARMUP_TIMEOUT = float(os.getenv("MODEL_WARMUP_TIMEOUT", "300"))
+
+
+class StartupReport:
+    """Where process start time goes: module imports, app startup hooks and model warm-up."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+        self.ready_at: Optional[float] = None
+        self.models_ready: Dict[str, bool] = {}
+        self.warmup_errors: Dict[str, str] = {}
+
+    def record(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def mark_ready(self):
+        """The app accepts requests from here on; warm-up may still be running."""
+        self.ready_at = time.perf_counter()
+        logger.info(self.summary_line())
+
+    def summary_line(self) -> str:
+        phases = " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.phases)
+        return f"Startup: {phases}"
+
+    def summary(self) -> Dict:
+        return {
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases},
+            "seconds_to_ready": round(self.ready_at - self.started, 4) if self.ready_at else None,
+            "models_ready": self.models_ready,
+            "warmup_errors": self.warmup_errors,
+        }
+
+
+# Created as early as possible (main.py imports this first) so import time is covered
+startup_report = StartupReport()
+
+
+async def warm_up_model(
+    client, model: str, system: str = "", options: Optional[Dict] = None, timeout: float = MODEL_WARMUP_TIMEOUT
+):
+    """Background task: wait for Ollama, check ``model`` exists and load it before real traffic.
+
+    Failures are logged, never raised; the app keeps serving and the first
+    request loads the model the slow way.
+    """
+    started = time.perf_counter()
+    startup_report.models_ready[model] = False
+    delay = 1.0
+    while True:
+        try:
+            if not await client.has_model(model):
+                startup_report.warmup_errors[model] = f"Model {model} not found"
+                logger.error(f"Model {model} not found in Ollama, skipping warm-up")
+                return
+            load_seconds = await client.warm_up(model, system, options)
+            startup_report.record(f"model_warmup[{model}]", time.perf_counter() - started)
+            startup_report.models_ready[model] = True
+            startup_report.warmup_errors.pop(model, None)
+            logger.info(f"Model {model} resident after {load_seconds:.1f}s warm-up (keep_alive={client.keep_alive})")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            startup_report.warmup_errors[model] = error
+            if time.perf_counter() - started + delay > timeout:
+                logger.error(f"Model {model} warm-up gave up: {error}")
+                return
+            logger.warning(f"Model {model} warm-up failed ({error}), retrying in {delay:.0f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
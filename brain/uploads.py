@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import uuid
+from typing import Optional, Sequence
+
+from fastapi import HTTPException, UploadFile
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_MAX_IMAGE_BYTES = int(os.getenv("UPLOAD_MAX_IMAGE_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_MAX_AUDIO_BYTES = int(os.getenv("UPLOAD_MAX_AUDIO_BYTES", str(25 * 1024 * 1024)))
+
+IMAGE_TYPES = ("image/",)
+AUDIO_TYPES = ("audio/",)
+
+# Leading bytes of the formats phones actually send; checked against the first chunk
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"OggS", "audio/ogg"),
+    (b"ID3", "audio/mpeg"),
+    (b"\xff\xfb", "audio/mpeg"),
+    (b"\xff\xf3", "audio/mpeg"),
+    (b"\xff\xf1", "audio/aac"),
+    (b"\xff\xf9", "audio/aac"),
+    (b"#!AMR", "audio/amr"),
+    (b"fLaC", "audio/flac"),
+    (b"\x1a\x45\xdf\xa3", "audio/webm"),
+)
+_RIFF_TYPES = {b"WEBP": "image/webp", b"WAVE": "audio/wav"}
+_FTYP_BRANDS = {
+    b"heic": "image/heic", b"heix": "image/heic", b"mif1": "image/heif", b"avif": "image/avif",
+    b"M4A ": "audio/mp4", b"M4B ": "audio/mp4", b"3gp4": "audio/3gpp", b"3gp5": "audio/3gpp",
+}
+
+
+class UploadRejected(HTTPException):
+    """The upload is too large or not of an accepted type."""
+
+
+class StoredUpload:
+    def __init__(self, path: str, size: int, sha256: str, mime_type: str, filename: str):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self.filename = filename
+
+    @property
+    def kind(self) -> str:
+        return self.mime_type.split("/", 1)[0]
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """MIME type from the file's leading bytes, or None if unrecognised."""
+    for signature, mime_type in _SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] in _RIFF_TYPES:
+        return _RIFF_TYPES[head[8:12]]
+    if head[4:8] == b"ftyp":
+        # Generic MP4 brands (isom, mp42) hold audio or video alike; trust the declared type
+        return _FTYP_BRANDS.get(head[8:12])
+    return None
+
+
+def safe_filename(filename: Optional[str]) -> str:
+    # Client filenames may carry directories ("../../x") or be missing entirely
+    name = os.path.basename((filename or "").replace("\\", "/")).strip()
+    return name or "upload"
+
+
+def max_bytes_for(mime_type: str) -> int:
+    return UPLOAD_MAX_AUDIO_BYTES if mime_type.startswith("audio/") else UPLOAD_MAX_IMAGE_BYTES
+
+
+class _Ingestion:
+    """Incremental state of one upload: type check on the first chunk, hash and size limit on every chunk."""
+
+    def __init__(self, upload: UploadFile, allowed: Sequence[str], max_bytes: Optional[int]):
+        self.filename = safe_filename(upload.filename)
+        self.declared = (upload.content_type or "").lower()
+        self.allowed = tuple(allowed)
+        self.max_bytes = max_bytes
+        self.mime_type: Optional[str] = None
+        self.size = 0
+        self.hash = hashlib.sha256()
+
+    def check(self, chunk: bytes):
+        if self.mime_type is None:
+            sniffed = sniff_mime(chunk[:32])
+            guessed = self.declared or mimetypes.guess_type(self.filename)[0] or "application/octet-stream"
+            # Content wins over what the client claims
+            self.mime_type = sniffed or guessed
+            if not self.mime_type.startswith(self.allowed):
+                self._reject(415, f"Invalid file type for {self.filename}. Allowed: {', '.join(self.allowed)}")
+            if self.max_bytes is None:
+                self.max_bytes = max_bytes_for(self.mime_type)
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self._reject(413, f"{self.filename} is larger than the {self.max_bytes / (1024 * 1024):g} MB limit")
+
+    def _reject(self, status_code: int, detail: str):
+        logger.warning(f"Upload rejected ({self.mime_type}, declared {self.declared or 'none'}): {detail}")
+        raise UploadRejected(status_code=status_code, detail=detail)
+
+    def write(self, handle, chunk: bytes):
+        self.hash.update(chunk)
+        handle.write(chunk)
+
+    def result(self, path: str) -> StoredUpload:
+        return StoredUpload(path, self.size, self.hash.hexdigest(), self.mime_type or self.declared, self.filename)
+
+
+def _temp_path(directory: str) -> str:
+    return os.path.join(directory, f".upload-{uuid.uuid4().hex}.part")
+
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def ingest_upload(
+    upload: UploadFile,
+    directory: str,
+    name: Optional[str] = None,
+    allowed: Sequence[str] = IMAGE_TYPES,
+    max_bytes: Optional[int] = None,
+) -> StoredUpload:
+    """Stream ``upload`` into ``directory`` chunk by chunk without blocking the event loop.
+
+    The type is checked on the first chunk and the size limit on every chunk,
+    so an oversized or wrong file is rejected (413/415) before it is fully
+    written. Data goes to a temporary file renamed into place at the end;
+    ``name`` defaults to the sanitised client filename.
+    """
+    state = _Ingestion(upload, allowed, max_bytes)
+    await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+    temp_path = _temp_path(directory)
+    handle = await asyncio.to_thread(open, temp_path, "wb")
+    try:
+        try:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                state.check(chunk)
+                await asyncio.to_thread(state.write, handle, chunk)
+        finally:
+            await asyncio.to_thread(handle.close)
+        if state.mime_type is None:
+            raise UploadRejected(status_code=400, detail=f"{state.filename} is empty")
+        path = os.path.join(directory, name or state.filename)
+        await asyncio.to_thread(os.replace, temp_path, path)
+    except BaseException:
+        await asyncio.to_thread(_discard, temp_path)
+        raise
+    return state.result(path)
+
+
+def ingest_upload_sync(
+    upload: UploadFile,
+    directory: str,
+    name: Optional[str] = None,
+    allowed: Sequence[str] = IMAGE_TYPES,
+    max_bytes: Optional[int] = None,
+) -> StoredUpload:
+    """Same as ``ingest_upload`` for sync handlers, which FastAPI already runs in a worker thread."""
+    state = _Ingestion(upload, allowed, max_bytes)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = _temp_path(directory)
+    try:
+        with open(temp_path, "wb") as handle:
+            while True:
+                chunk = upload.file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                state.check(chunk)
+                state.write(handle, chunk)
+        if state.mime_type is None:
+            raise UploadRejected(status_code=400, detail=f"{state.filename} is empty")
+        path = os.path.join(directory, name or state.filename)
+        os.replace(temp_path, path)
+    except BaseException:
+        _discard(temp_path)
+        raise
+    return state.result(path)
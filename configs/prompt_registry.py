@@ -0,0 +1,94 @@
+import hashlib
+import math
+import re
+from typing import Dict
+
+from configs.response_rules import (
+    accident_assistant_system_message,
+    health_assistant_system_message,
+    report_analyzer_rules,
+    system_message,
+    voice_message_rule,
+)
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: word/punctuation pieces, floored at ~4 chars per token."""
+    if not text:
+        return 0
+    return max(len(_TOKEN_PATTERN.findall(text)), math.ceil(len(text) / 4))
+
+
+class CompiledPrompt:
+    """An immutable system prompt with its size precomputed."""
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        self.text = text
+        self.byte_length = len(text.encode("utf-8"))
+        self.token_estimate = estimate_tokens(text)
+        self.digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def summary(self) -> Dict:
+        return {
+            "bytes": self.byte_length,
+            "token_estimate": self.token_estimate,
+            "digest": self.digest,
+        }
+
+
+class PromptRegistry:
+    """Prompts built once at import time and handed out as the same string objects.
+
+    Reusing byte-identical system prompts (and keeping dynamic text after them)
+    lets Ollama's prefix cache skip prefill for the shared part of every request.
+    """
+
+    def __init__(self):
+        self._prompts: Dict[str, CompiledPrompt] = {}
+
+    def register(self, name: str, text: str) -> CompiledPrompt:
+        compiled = CompiledPrompt(name, text)
+        self._prompts[name] = compiled
+        return compiled
+
+    def get(self, name: str) -> CompiledPrompt:
+        return self._prompts[name]
+
+    def text(self, name: str) -> str:
+        return self._prompts[name].text
+
+    def token_estimate(self, name: str) -> int:
+        return self._prompts[name].token_estimate
+
+    def summary(self) -> Dict[str, Dict]:
+        return {name: prompt.summary() for name, prompt in self._prompts.items()}
+
+
+# Static part of the emergency report prompt; the description is appended after
+# it so the whole rules block stays a cacheable prefix.
+_report_prompt = f"""Report Analysis Request:
+
+Please analyze this report following these guidelines:
+{report_analyzer_rules.strip()}
+
+Provide a detailed analysis including:
+1. Emergency Level Assessment
+2. Recommended Response
+3. Required Resources
+4. Special Considerations
+5. Follow-up Actions
+"""
+
+prompt_registry = PromptRegistry()
+prompt_registry.register("chat", system_message["content"])
+prompt_registry.register("voice", voice_message_rule.strip())
+prompt_registry.register("health", health_assistant_system_message.strip())
+prompt_registry.register("road-safety", accident_assistant_system_message.strip())
+prompt_registry.register("report", _report_prompt)
+
+
+def report_prompt(description: str) -> str:
+    return f"{prompt_registry.text('report')}\nDescription: {description}\n"
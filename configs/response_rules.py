@@ -337,4 +337,15 @@ Remember to:
 - Include specific details when available
 - Consider cultural and environmental factors
 - Maintain privacy and confidentiality
-"""
\ No newline at end of file
+"""
+def summary_message(previous_summary: str, turns: str):
+    return f"""Update the running summary of a conversation between a user and {assistant_name}.
+
+Current summary:
+{previous_summary or "(none yet)"}
+
+New messages to fold in:
+{turns}
+
+Write the updated summary in at most 150 words. Keep names, symptoms, locations, decisions and open questions. Do not add anything that was not said. Reply with the summary text only.
+"""
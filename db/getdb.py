@@ -1,9 +1,13 @@
 from sqlalchemy.orm import Session
-from .database import SessionLocal, engine, Base
+from .database import AsyncSessionLocal, SessionLocal, async_engine, engine, Base
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
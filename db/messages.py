@@ -0,0 +1,139 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import Conversation, ConversationMessage
+
+# Message keys kept in their own columns; anything else goes to ``extra``
+_COLUMNS = ("role", "content", "timestamp")
+# Lengths of the title and preview stored on the conversation for listings
+TITLE_CHARS = 200
+PREVIEW_CHARS = 160
+
+
+def conversation_title(message: Dict) -> str:
+    return (message.get("content") or "")[:TITLE_CHARS]
+
+
+def conversation_preview(message: Dict) -> str:
+    return (message.get("content") or "")[:PREVIEW_CHARS]
+
+
+def message_row(conversation_id: int, seq: int, data: Dict) -> ConversationMessage:
+    """A message in the history JSON format ({"role", "content", "timestamp", ...}) as a row."""
+    extra = {key: value for key, value in data.items() if key not in _COLUMNS}
+    try:
+        created_at = datetime.fromisoformat(data["timestamp"])
+    except (KeyError, TypeError, ValueError):
+        created_at = datetime.now()
+    return ConversationMessage(
+        conversation_id=conversation_id,
+        seq=seq,
+        role=data.get("role", ""),
+        content=data.get("content") or "",
+        extra=extra or None,
+        created_at=created_at,
+    )
+
+
+def message_dict(row: ConversationMessage) -> Dict:
+    """Inverse of ``message_row``: the format the API and the context manager use."""
+    data = {"role": row.role, "content": row.content, "timestamp": row.created_at.isoformat()}
+    if row.extra:
+        data.update(row.extra)
+    return data
+
+
+def legacy_rows(conversation_id: int, history: List[Dict]) -> List[ConversationMessage]:
+    return [message_row(conversation_id, seq, data) for seq, data in enumerate(history)]
+
+
+async def append_message(db: AsyncSession, user_id: int, conversation_id: Optional[int], data: Dict) -> int:
+    """Append one message and return the conversation id; creates the conversation if needed.
+
+    The seq comes from an atomic increment of ``message_count``, so the cost
+    of a turn does not depend on the length of the conversation and
+    concurrent appends never collide. Not committed.
+    """
+    now = datetime.now()
+    seq = None
+    if conversation_id is not None:
+        seq = await db.scalar(
+            update(Conversation)
+            .where(Conversation.user_id == user_id, Conversation.conversation_id == conversation_id)
+            .values(
+                message_count=Conversation.message_count + 1,
+                preview=conversation_preview(data),
+                last_activity=now
+            )
+            .returning(Conversation.message_count - 1)
+        )
+
+    if seq is None:
+        conversation = Conversation(
+            user_id=user_id,
+            conversation_id=conversation_id,
+            history=[],
+            message_count=1,
+            title=conversation_title(data),
+            preview=conversation_preview(data),
+            last_activity=now,
+            created_at=now
+        )
+        db.add(conversation)
+        await db.flush()
+        conversation_id, seq = conversation.conversation_id, 0
+    elif seq == 0:
+        # First append since this column exists: move a not yet backfilled JSON history over first
+        history = await db.scalar(select(Conversation.history).where(Conversation.conversation_id == conversation_id))
+        values = {"title": conversation_title(history[0] if history else data)}
+        if history:
+            db.add_all(legacy_rows(conversation_id, history))
+            seq = len(history)
+            values.update(message_count=seq + 1, history=[])
+        await db.execute(update(Conversation).where(Conversation.conversation_id == conversation_id).values(**values))
+
+    db.add(message_row(conversation_id, seq, data))
+    return conversation_id
+
+
+async def read_messages(
+    db: AsyncSession,
+    user_id: Optional[int],
+    conversation_id: int,
+    start: int = 0,
+    limit: Optional[int] = None
+) -> Tuple[List[Dict], int]:
+    """Messages with seq >= ``start``, at most the latest ``limit``, and the seq of the first one returned.
+
+    With ``user_id`` only a conversation of that user is read.
+    """
+    owner = [Conversation.user_id == user_id] if user_id is not None else []
+    query = (
+        select(ConversationMessage)
+        .join(Conversation, Conversation.conversation_id == ConversationMessage.conversation_id)
+        .where(
+            *owner,
+            ConversationMessage.conversation_id == conversation_id,
+            ConversationMessage.seq >= start,
+        )
+        .order_by(ConversationMessage.seq.desc())
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    rows = list(reversed((await db.scalars(query)).all()))
+    if rows:
+        return [message_dict(row) for row in rows], rows[0].seq
+
+    # Nothing stored yet: the conversation may still be waiting for the backfill
+    history = await db.scalar(
+        select(Conversation.history).where(
+            *owner,
+            Conversation.conversation_id == conversation_id,
+            Conversation.message_count == 0,
+        )
+    )
+    if not history:
+        return [], start
+    first = max(start, len(history) - limit) if limit is not None else start
+    return history[first:], first
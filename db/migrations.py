@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+from sqlalchemy import inspect, select, text, update
+from .database import SessionLocal
+from .messages import conversation_preview, conversation_title, legacy_rows
+from .models import Conversation, ConversationMessage
+
+logger = logging.getLogger(__name__)
+
+# Columns added to existing tables after their creation: (table, column, DDL,
+# statement filling existing rows or None). create_all only creates missing
+# tables, so these are added here on startup.
+ADDED_COLUMNS = [
+    ("conversations", "message_count", "INTEGER NOT NULL DEFAULT 0", None),
+    ("conversations", "title", "VARCHAR", None),
+    ("conversations", "preview", "VARCHAR", None),
+    (
+        "conversations", "last_activity", "TIMESTAMP",
+        "UPDATE conversations SET last_activity = COALESCE(created_at, CURRENT_TIMESTAMP) WHERE last_activity IS NULL",
+    ),
+]
+# Columns made NOT NULL after they were added: (table, column, server default).
+# SQLite cannot alter a column; there the fill above and the model default keep it set.
+NOT_NULL_COLUMNS = [
+    ("conversations", "last_activity", "CURRENT_TIMESTAMP"),
+]
+# Indexes on tables that may predate them
+ADDED_INDEXES = list(Conversation.__table__.indexes)
+
+BACKFILL_BATCH = 200
+
+
+def upgrade_schema(engine):
+    """Bring tables created by an earlier version up to the models.
+
+    Adds the columns in ``ADDED_COLUMNS`` and indexes in ``ADDED_INDEXES`` the
+    database does not have yet, and applies ``NOT_NULL_COLUMNS``.
+    """
+    inspector = inspect(engine)
+    existing = {}
+    with engine.begin() as connection:
+        for table, column, ddl, fill in ADDED_COLUMNS:
+            if table not in existing:
+                existing[table] = {c["name"] for c in inspector.get_columns(table)}
+            if column not in existing[table]:
+                logger.info(f"Adding column {table}.{column}")
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                if fill:
+                    connection.execute(text(fill))
+                existing[table].add(column)
+        if connection.dialect.name != "sqlite":
+            for table, column, default in NOT_NULL_COLUMNS:
+                current = {c["name"]: c for c in inspect(connection).get_columns(table)}
+                if current[column]["nullable"]:
+                    logger.info(f"Making {table}.{column} NOT NULL")
+                    connection.execute(text(f"UPDATE {table} SET {column} = {default} WHERE {column} IS NULL"))
+                    connection.execute(text(
+                        f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT {default}, "
+                        f"ALTER COLUMN {column} SET NOT NULL"
+                    ))
+        for index in ADDED_INDEXES:
+            index.create(bind=connection, checkfirst=True)
+
+
+def backfill_messages(batch_size: int = BACKFILL_BATCH) -> int:
+    """Move JSON ``Conversation.history`` arrays into ``conversation_messages``.
+
+    Blocking; meant for a worker thread at startup. Idempotent and safe next
+    to live traffic: a conversation is claimed by a conditional update of its
+    ``message_count`` from 0, so one that received a message in the meantime
+    (which backfills it inline) is skipped. Returns the number of
+    conversations moved.
+    """
+    started = time.perf_counter()
+    moved = 0
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            batch = db.execute(
+                select(Conversation.conversation_id, Conversation.history)
+                .where(Conversation.message_count == 0, Conversation.conversation_id > last_id)
+                .order_by(Conversation.conversation_id)
+                .limit(batch_size)
+            ).all()
+            if not batch:
+                break
+            for conversation_id, history in batch:
+                last_id = conversation_id
+                if not history:
+                    continue
+                rows = legacy_rows(conversation_id, history)
+                claimed = db.execute(
+                    update(Conversation)
+                    .where(Conversation.conversation_id == conversation_id, Conversation.message_count == 0)
+                    .values(
+                        message_count=len(history),
+                        history=[],
+                        title=conversation_title(history[0]),
+                        preview=conversation_preview(history[-1]),
+                        last_activity=rows[-1].created_at
+                    )
+                ).rowcount
+                if claimed:
+                    db.add_all(rows)
+                    moved += 1
+            db.commit()
+    finally:
+        db.close()
+    if moved:
+        logger.info(f"Backfilled {moved} conversations into conversation_messages in {time.perf_counter() - started:.1f}s")
+    return moved
+
+
+def backfill_titles(batch_size: int = BACKFILL_BATCH) -> int:
+    """Fill title, preview and last_activity of conversations moved to messages before those columns existed."""
+    filled = 0
+    last_id = 0
+    db = SessionLocal()
+    try:
+        while True:
+            batch = db.execute(
+                select(Conversation.conversation_id, Conversation.message_count)
+                .where(Conversation.title.is_(None), Conversation.message_count > 0, Conversation.conversation_id > last_id)
+                .order_by(Conversation.conversation_id)
+                .limit(batch_size)
+            ).all()
+            if not batch:
+                break
+            for conversation_id, message_count in batch:
+                last_id = conversation_id
+                rows = (
+                    db.query(ConversationMessage)
+                    .filter(
+                        ConversationMessage.conversation_id == conversation_id,
+                        ConversationMessage.seq.in_(sorted({0, message_count - 1}))
+                    )
+                    .order_by(ConversationMessage.seq)
+                    .all()
+                )
+                if not rows:
+                    continue
+                first, last = rows[0], rows[-1]
+                db.execute(
+                    update(Conversation)
+                    .where(Conversation.conversation_id == conversation_id, Conversation.title.is_(None))
+                    .values(
+                        title=conversation_title({"content": first.content}),
+                        preview=conversation_preview({"content": last.content}),
+                        last_activity=last.created_at
+                    )
+                )
+                filled += 1
+            db.commit()
+    finally:
+        db.close()
+    return filled
+
+
+async def backfill_in_background():
+    try:
+        await asyncio.to_thread(backfill_messages)
+        await asyncio.to_thread(backfill_titles)
+    except Exception as e:
+        logger.error(f"Message backfill failed, unmigrated conversations are read from JSON: {str(e)}")
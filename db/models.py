@@ -1,4 +1,4 @@
-from sqlalchemy import JSON, Boolean, Column, ForeignKey, Integer, String, DateTime
+from sqlalchemy import JSON, Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Text, func
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -44,9 +44,34 @@ class Conversation(Base):
 
     conversation_id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    history = Column(JSON, nullable=False, default=list)  # List of interactions, each interaction is a list of messages
+    history = Column(JSON, nullable=False, default=list)  # Legacy message list; emptied once moved to conversation_messages
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")  # Next message seq
+    title = Column(String, nullable=True)  # Start of the first message, for conversation lists
+    preview = Column(String, nullable=True)  # Start of the latest message
+    last_activity = Column(DateTime, nullable=False, default=datetime.now, server_default=func.now())  # Time of the latest message
     created_at = Column(DateTime, default=datetime.utcnow)
     user = relationship("User")
+
+    __table_args__ = (
+        # Serves the per-user list ordered by activity, and any lookup by user_id
+        Index("ix_conversations_user_activity", "user_id", "last_activity", "conversation_id"),
+    )
+
+
+class ConversationMessage(Base):
+    __tablename__ = "conversation_messages"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    conversation_id = Column(Integer, ForeignKey("conversations.conversation_id"), nullable=False)
+    seq = Column(Integer, nullable=False)  # Position in the conversation, from 0
+    role = Column(String, nullable=False)
+    content = Column(Text, nullable=False)
+    extra = Column(JSON(none_as_null=True), nullable=True)  # e.g. {"interrupted": true, "images": [...]}
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+
+    __table_args__ = (
+        Index("ix_conversation_messages_conversation_seq", "conversation_id", "seq", unique=True),
+    )
     
 class AdminUser(Base):
     __tablename__ = "admin_users"
@@ -86,3 +111,24 @@ class AdminNotification(Base):
     user_image_path = Column(String, nullable=True)  # Image related to the user
     user_voice_path = Column(String, nullable=True)  # Voice recording related to the user
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ConversationSummary(Base):
+    __tablename__ = "conversation_summaries"
+
+    conversation_id = Column(Integer, ForeignKey("conversations.conversation_id"), primary_key=True)
+    summary = Column(Text, nullable=False, default="")  # Rolling summary of the turns older than the context window
+    covered_turns = Column(Integer, nullable=False, default=0)  # Number of history entries folded into the summary
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+
+    sha256 = Column(String(64), primary_key=True)  # Content hash, also the file name in the media store
+    path = Column(String, nullable=False)  # media/ab/cd/<sha256>.<ext>
+    size = Column(Integer, nullable=False)
+    mime_type = Column(String, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)  # AdminNotification and Conversation rows pointing at it
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = Column(DateTime, default=datetime.utcnow, nullable=False)  # Last upload or reference; GC grace starts here
@@ -1,7 +1,31 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from db.getdb import engine, Base
-from routes import chat, auth , voice,health_router,road_safety,users,notification_handler, analyze_report
+import asyncio
+import logging
+import os
+# Imported first so the startup report covers every import below
+from brain.startup import startup_report, warm_up_model, MODEL_WARMUP
+
+with startup_report.phase("import_framework"):
+    from fastapi import FastAPI, Request
+    from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import JSONResponse, PlainTextResponse
+with startup_report.phase("import_db"):
+    from db.database import checkout_observers
+    from db.getdb import async_engine, engine, Base
+    from db.migrations import backfill_in_background, upgrade_schema
+with startup_report.phase("import_brain"):
+    from brain.image_pipeline import image_pipeline
+    from brain.media_store import media_store
+    from brain.metrics import MetricsMiddleware, observe_pool_checkout, registry
+    from brain.model_router import model_router
+    from brain.ollama_client import ollama_client
+    from brain.scheduler import SchedulerBusy
+    from brain.search_engine import searx_client
+    from configs.prompt_registry import prompt_registry
+with startup_report.phase("import_routes"):
+    from routes import chat, auth , voice,health_router,road_safety,users,notification_handler, analyze_report, media, stats
+
+# Application-wide logging; set LOG_LEVEL=DEBUG to get per-request traces and payload dumps
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 # Create FastAPI app
 app = FastAPI(title="Chatbot API")
@@ -13,13 +37,62 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],  # Conversation list pagination
 )
 
+# Request traces, X-Request-ID and latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+# Connection pool wait and timeouts for /metrics
+checkout_observers.append(observe_pool_checkout)
+
+# Fast rejection when the model queue is full
+@app.exception_handler(SchedulerBusy)
+async def scheduler_busy_handler(request: Request, exc: SchedulerBusy):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"error": exc.detail, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # Initialize database
 @app.on_event("startup")
 async def startup():
     # Create database tables
-    Base.metadata.create_all(bind=engine)
+    with startup_report.phase("create_tables"):
+        Base.metadata.create_all(bind=engine)
+        upgrade_schema(engine)
+    # Move legacy JSON histories into conversation_messages without delaying startup
+    app.state.backfill_task = asyncio.create_task(backfill_in_background())
+    # Open the shared, pooled model client
+    with startup_report.phase("open_clients"):
+        await ollama_client.start()
+        await searx_client.start()
+    # Nothing is routed to the small model until Ollama confirms it is installed
+    app.state.model_discovery_task = asyncio.create_task(model_router.discover(ollama_client))
+    # Load the model weights in the background so startup does not wait on (or fail with) Ollama
+    if MODEL_WARMUP:
+        app.state.warmup_tasks = [
+            asyncio.create_task(warm_up_model(
+                ollama_client, model, prompt_registry.text("chat"), model_router.load_options(model)
+            ))
+            for model in model_router.models()
+        ]
+    # Reclaim unreferenced media blobs periodically
+    app.state.media_gc_task = asyncio.create_task(media_store.gc_loop())
+    startup_report.mark_ready()
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in getattr(app.state, "warmup_tasks", []):
+        task.cancel()
+    if getattr(app.state, "model_discovery_task", None):
+        app.state.model_discovery_task.cancel()
+    if getattr(app.state, "media_gc_task", None):
+        app.state.media_gc_task.cancel()
+    await ollama_client.close()
+    await searx_client.close()
+    image_pipeline.shutdown()
+    await async_engine.dispose()
 
 # Include routers
 app.include_router(auth.router, prefix="/api", tags=["Authentication"])
@@ -30,11 +103,18 @@ app.include_router(road_safety.router, prefix="/api", tags=["Chat"])
 app.include_router(users.router, prefix="/api", tags=["Road Safety"])
 app.include_router(notification_handler.router, prefix="/api", tags=["Notification"])
 app.include_router(analyze_report.router, prefix="/api", tags=["Notification"])
+app.include_router(media.router, prefix="/api", tags=["Media"])
+app.include_router(stats.router, prefix="/api", tags=["Stats"])
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Chatbot API"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of request, phase and model histograms."""
+    return registry.render()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,95 +1,68 @@
-from fastapi import APIRouter, File, Form, UploadFile, Depends, HTTPException
+from fastapi import APIRouter, File, Form, UploadFile, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from typing import List
-import os
-from brain.model_init import ChatModel
-from configs.response_rules import report_analyzer_rules
-from db.getdb import get_db
-from sqlalchemy.orm import Session
+from brain.model_init import chat_model
+from brain.scheduler import model_scheduler
+from brain.sse import cancel_on_disconnect
+from brain.media_store import media_store
+from configs.prompt_registry import report_prompt
+from db.getdb import get_async_db
+from sqlalchemy.ext.asyncio import AsyncSession
 
 router = APIRouter()
-chat_model = ChatModel()
 
 @router.post("/analyze/report")
 async def analyze_report(
+    request: Request,
     description: str = Form(...),
     images: List[UploadFile] = File(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Analyze a report with optional images and provide a streaming response
     """
     image_paths = []
-    upload_dir = "uploads/reports"
 
-    try:
-        # Ensure the upload directory exists
-        os.makedirs(upload_dir, exist_ok=True)
+    # Emergency reports have top priority, but still fail fast if even their queue is full
+    model_scheduler.check_admission("report")
 
-        # Save uploaded images
+    try:
+        # Save uploaded images; type and size are checked while streaming to disk
         if images:
             for image in images:
-                if not image.content_type.startswith("image/"):
-                    raise HTTPException(
-                        status_code=400,
-                        detail=f"Invalid file type for {image.filename}. Only images are allowed."
-                    )
-
-                file_path = os.path.join(upload_dir, image.filename)
-                with open(file_path, "wb") as f:
-                    content = await image.read()
-                    f.write(content)
-
-                if not os.path.exists(file_path):
-                    raise HTTPException(
-                        status_code=500,
-                        detail=f"Failed to save image: {file_path}"
-                    )
-
-                image_paths.append(file_path)
+                stored = await media_store.save(image)
+                image_paths.append(stored.path)
 
-        # Build the base prompt
-        prompt = f"""
-        Report Analysis Request:
-        Description: {description}
-        
-        Please analyze this report following these guidelines:
-        {report_analyzer_rules}
-        
-        Provide a detailed analysis including:
-        1. Emergency Level Assessment
-        2. Recommended Response
-        3. Required Resources
-        4. Special Considerations
-        5. Follow-up Actions
-        """
+        # Static rules first, description last, so the prompt prefix is cacheable
+        prompt = report_prompt(description)
 
         if image_paths:
             # Stream with image analysis
-            resposne_stream = chat_model.analyzeImageStream(
+            resposne_stream = chat_model.analyzeImageStreamAsync(
                         prompt=prompt,
                         image_path=image_paths,
                         history=[]
                     )
 
             return StreamingResponse(
-                resposne_stream,
+                cancel_on_disconnect(request, resposne_stream, "report"),
                 media_type="text/event-stream"
             )
 
         else:
             # Text-only analysis
             return StreamingResponse(
-                chat_model.quick_streamed_health(prompt, "health"),
+                cancel_on_disconnect(
+                    request,
+                    chat_model.quick_streamed_health_async(prompt, "health", use_cache=False, endpoint="report"),
+                    "report"
+                ),
                 media_type="text/event-stream"
             )
 
     except Exception as e:
-        # Cleanup in case of an exception
-        for path in image_paths:
-            try:
-                if os.path.exists(path):
-                    os.remove(path)
-            except:
-                pass
+        # Saved images are not removed here: a blob may be shared with other
+        # uploads, and unreferenced ones are reclaimed by the media store GC
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Report analysis failed: {str(e)}")
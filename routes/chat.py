@@ -1,13 +1,23 @@
-import os
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Request, Response, UploadFile
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from db.getdb import get_db
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.getdb import AsyncSessionLocal, get_async_db
+from db.messages import append_message, conversation_preview, conversation_title, read_messages
 from db.models import Conversation, User
 from brain.model_active import ModelInit
+from brain.model_init import chat_model
+from brain.context_manager import HISTORY_WINDOW_MAX, context_manager, get_summary
+from brain.metrics import span
+from brain.scheduler import model_scheduler
+from brain.sse import cancel_on_disconnect
+from brain.media_store import media_store
+from brain.uploads import UploadRejected
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import base64
 import json
 import logging
 
@@ -25,18 +35,27 @@ class ChatRequest(BaseModel):
 
 model = ModelInit()
 
-async def response_generator(history: List[Dict], db: Session, user_id: str, query: str, is_voice: bool, is_websearch: bool, is_image_analysis: bool, conversation_id: str, files: Optional[List[UploadFile]] = None,  image_path: Optional[str] = None):
+# Conversations per page of the history list
+CONVERSATION_PAGE_SIZE = 50
+CONVERSATION_PAGE_MAX = 100
+
+async def response_generator(history: List[Dict], user_id: int, query: str, is_voice: bool, is_websearch: bool, is_image_analysis: bool, conversation_id: Optional[int], files: Optional[List[UploadFile]] = None,  image_path: Optional[str] = None, image_paths: Optional[List[str]] = None, full_history: Optional[List[Dict]] = None, summary=None, first_verbatim: int = 0, history_offset: int = 0):
     logger.info(f"Starting response for query: {query}")
     full_response = ""
+    disconnected = False
+    cut_off = False
+    # The stream outlives the request's dependencies, so it has its own session
+    db = AsyncSessionLocal()
     
     try:
         # Save user message first
-        save_history(
+        conversation_id = await save_history(
             user_id=user_id,
             role="user",
             content=query,
             conversation_id=conversation_id,  # Fixed typo here
-            db=db
+            db=db,
+            images=image_paths
         )
         # send metadata converstation to client
 
@@ -46,21 +65,33 @@ async def response_generator(history: List[Dict], db: Session, user_id: str, que
             generator = model.text_offline_response(
                 query=query,
                 history=history,
-                is_voice=True
+                is_voice=True,
+                conversation_id=conversation_id
             )
         elif image_path:
             logger.info(f"Using image analysis mode with image: {image_path}")
             generator = model.image_offline_response(
                 query=query,
                 history=history,
-                image_path=image_path
+                image_path=image_path,
+                conversation_id=conversation_id
+            )
+        elif is_websearch:
+            logger.info("Using web search response mode")
+            generator = chat_model.analyzeTextStream(
+                prompt=query,
+                user_id=user_id,
+                history=history,
+                is_search=True,
+                conversation_id=conversation_id
             )
         else:
             logger.info("Using standard text response mode")
             generator = model.text_offline_response(
                 query=query,
                 history=history,
-                is_voice=False
+                is_voice=False,
+                conversation_id=conversation_id
             )
 
         # Stream the response
@@ -75,86 +106,116 @@ async def response_generator(history: List[Dict], db: Session, user_id: str, que
                 chunk_data = json.loads(chunk.replace('data: ', ''))
                 if 'content' in chunk_data:
                     full_response += chunk_data['content']
+                # Error frame (model failure, truncated stream, preemption): the answer stops here
+                cut_off = cut_off or 'error' in chunk_data
             except json.JSONDecodeError:
                 logger.warning(f"Failed to decode chunk JSON: {chunk}")
             
             yield chunk
 
+    except (asyncio.CancelledError, GeneratorExit):
+        # Client went away (see cancel_on_disconnect); nothing more can be sent
+        disconnected = True
+        raise
     except Exception as e:
         logger.error(f"Error in response generator: {str(e)}")
         yield f"data: Error: {str(e)}\n\n"
     finally:
-        # Save assistant response in finally block to ensure it runs
-    
-        yield "data: [DONE]\n\n"
-
-        # send metadata converstation to client
-        if conversation_id:
-            yield f'data: {{"metadata": {{"conversation_id": "{conversation_id}", "user_id": "{user_id}"}}}}'
-        else:
-            conversation = db.query(Conversation).filter(Conversation.user_id == user_id).order_by(Conversation.created_at.desc()).first()
-            conversation_id = conversation.conversation_id if conversation else None
-            yield f'data: {{"metadata": {{"conversation_id": "{conversation_id}", "user_id": "{user_id}"}}}}'
-
-
-        if full_response:
-            try:
-                save_history(
+        # Persist first, without yielding: after a disconnect the generator must
+        # not yield again, and the partial answer is still worth keeping
+        save_failed = False
+        try:
+            # No conversation id means the user message was not saved either
+            if full_response and conversation_id is not None:
+                await save_history(
                     user_id=user_id,
                     role="assistant",
                     content=full_response,
                     conversation_id=conversation_id,
-                    db=db
+                    db=db,
+                    interrupted=disconnected or cut_off
                 )
-        
-            except Exception as e:
-                logger.error(f"Failed to save conversation history: {str(e)}")
+        except Exception as e:
+            logger.error(f"Failed to save conversation history: {str(e)}")
+            save_failed = True
+        finally:
+            await db.close()
+
+        # Fold turns that fell out of the context window into the rolling summary
+        if full_history:
+            context_manager.schedule_refresh(conversation_id, full_history, summary, first_verbatim, history_offset)
+
+        if not disconnected:
+            yield "data: [DONE]\n\n"
+
+            # send metadata converstation to client
+            yield f'data: {{"metadata": {{"conversation_id": "{conversation_id}", "user_id": "{user_id}"}}}}'
+
+            if save_failed:
                 yield f"data: {json.dumps({'warning': 'Failed to save conversation history'})}\n\n"
 
 
 @router.post("/chat")
 async def chat(
-    user_id: str = Form(...),
+    request: Request,
+    user_id: int = Form(...),
     query: str = Form(...)  ,
     is_voice: bool = Form(False),
     is_websearch: bool = Form(False),
     is_image_analysis: bool = Form(False),
-    conversation_id: str = Form(None),
+    conversation_id: Optional[int] = Form(None),
     files: List[UploadFile] = Form(None),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    # Reject early with 429/503 if the model queue is full
+    model_scheduler.check_admission("voice" if is_voice else "chat")
+
     # Verify user exists
-    db_user = db.query(User).filter(User.id == user_id).first()
+    db_user = await db.get(User, user_id)
     if not db_user:
         raise HTTPException(status_code=400, detail="User not found")
     
     # Get conversation history
     if  conversation_id:
-        history = get_history(
+        with span("db_get_summary", "chat"):
+            summary = await get_summary(conversation_id, db)
+        # Turns already folded into the summary are never sent again, so they are not read
+        full_history, history_offset = await get_history(
         user_id=user_id,
         conversation_id=conversation_id,
-        db=db
+        db=db,
+        start=summary.covered_turns if summary else 0
         )
     else:
-        history = []
+        full_history = []
+        history_offset = 0
+        summary = None
+
+    # Fit the history into the endpoint's token budget (summary + recent turns)
+    history, first_verbatim = context_manager.fit(
+        full_history,
+        summary,
+        "voice" if is_voice else "chat",
+        offset=history_offset
+    )
     
     # Handle file upload if present
     image_path = None
+    image_paths = []
     if files:
         try:
-            os.makedirs(f"images/{user_id}", exist_ok=True)
             for file in files:
-                image_path = f"images/{user_id}/{file.filename}"
-                contents = await file.read()
-                with open(image_path, "wb") as f:
-                    f.write(contents)
-                await file.seek(0)
+                stored = await media_store.save(file)
+                image_paths.append(stored.path)
+            image_path = image_paths[-1]
+        except UploadRejected:
+            raise
         except Exception as e:
             logger.error(f"Error handling file upload: {str(e)}")
             raise HTTPException(status_code=400, detail=f"File upload failed: {str(e)}")
 
     return StreamingResponse(
-        response_generator(
+        cancel_on_disconnect(request, response_generator(
             user_id=user_id,
             query=query,
             is_voice=is_voice,
@@ -163,69 +224,118 @@ async def chat(
             conversation_id=conversation_id,
             files=files,
             history=history,
-            db=db,
-            image_path=image_path
-        ),
+            image_path=image_path,
+            image_paths=image_paths,
+            full_history=full_history,
+            summary=summary,
+            first_verbatim=first_verbatim,
+            history_offset=history_offset
+        ), "voice" if is_voice else "chat"),
         media_type="text/event-stream"
     )
 
-def get_history(user_id: str, conversation_id: str, db: Session) -> List[Dict]:
-    chat_entry = db.query(Conversation).filter(
-        Conversation.user_id == user_id,
-        Conversation.conversation_id == conversation_id
-    ).first()
-    return chat_entry.history if chat_entry else []
+async def get_history(user_id: int, conversation_id: int, db: AsyncSession, start: int = 0) -> Tuple[List[Dict], int]:
+    """Messages from seq ``start`` on (at most the latest HISTORY_WINDOW_MAX) and the seq of the first one."""
+    with span("db_get_history", "chat"):
+        return await read_messages(db, user_id, conversation_id, start=start, limit=HISTORY_WINDOW_MAX)
 
-def save_history(
-    user_id: str,
+async def save_history(
+    user_id: int,
     role: str,
     content: str,
-    conversation_id: str,
-    db: Session
-):
+    conversation_id: Optional[int],
+    db: AsyncSession,
+    interrupted: bool = False,
+    images: Optional[List[str]] = None
+) -> int:
     data = {
         "role": role,
         "content": content,
         "timestamp": datetime.now().isoformat()
     }
+    if interrupted:
+        # Client disconnected or the generation failed mid-answer; the stored text is partial
+        data["interrupted"] = True
+    if images:
+        # Media store paths; each one holds a reference on its blob
+        data["images"] = images
+        for path in images:
+            await media_store.add_ref_async(db, path)
 
-    chat_entry = db.query(Conversation).filter(
-        Conversation.user_id == user_id,
-        Conversation.conversation_id == conversation_id
-    ).first()
+    with span("db_save_history", "chat"):
+        # One appended row per message; the conversation's earlier messages are not touched
+        conversation_id = await append_message(db, user_id, conversation_id, data)
+        await db.commit()
+    return conversation_id
 
-    if chat_entry:
-        
-        history = chat_entry.history
-        db.query(Conversation).filter(Conversation.user_id == user_id, Conversation.conversation_id == conversation_id).update({
-            "history": history + [data]
-        })
-    else:
-        chat_entry = Conversation(
-            user_id=user_id,
-            conversation_id=conversation_id,
-            history=[data],
-            created_at=datetime.now()
-        )
-        db.add(chat_entry)
+def encode_cursor(last_activity: datetime, conversation_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{last_activity.isoformat()}|{conversation_id}".encode()).decode()
 
-    db.commit()
-    return chat_entry
+def decode_cursor(cursor: str):
+    try:
+        last_activity, conversation_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(last_activity), int(conversation_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
 
 @router.get("/chat/history/user/{user_id}")
-async def get_chat_history(user_id: str, db: Session = Depends(get_db)):
-    chat_entry = db.query(Conversation).filter(Conversation.user_id == user_id).order_by(Conversation.created_at.desc()).all()
+async def get_chat_history(
+    user_id: int,
+    response: Response,
+    limit: int = Query(CONVERSATION_PAGE_SIZE, ge=1, le=CONVERSATION_PAGE_MAX),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    A user's conversations, most recently active first, one page at a time.
+    The X-Next-Cursor response header, passed back as ``cursor``, gives the next page; it is absent on the last one.
+    """
+    # Keyset pagination on (last_activity, conversation_id) over the (user_id, last_activity, conversation_id) index
+    query = (
+        select(
+            Conversation.conversation_id,
+            Conversation.created_at,
+            Conversation.last_activity,
+            Conversation.title,
+            Conversation.preview,
+            Conversation.message_count
+        )
+        .where(Conversation.user_id == user_id)
+        .order_by(Conversation.last_activity.desc(), Conversation.conversation_id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(
+            tuple_(Conversation.last_activity, Conversation.conversation_id) < tuple_(*decode_cursor(cursor))
+        )
+    chat_entry = (await db.execute(query)).all()
+    if len(chat_entry) > limit:
+        chat_entry = chat_entry[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(chat_entry[-1].last_activity, chat_entry[-1].conversation_id)
+
+    # Conversations the backfill has not reached yet only have their JSON history
+    legacy = {}
+    unmigrated = [entry.conversation_id for entry in chat_entry if entry.message_count == 0]
+    if unmigrated:
+        legacy = dict((await db.execute(
+            select(Conversation.conversation_id, Conversation.history)
+            .where(Conversation.conversation_id.in_(unmigrated))
+        )).all())
+
     history = []
     for entry in chat_entry:
+        messages = legacy.get(entry.conversation_id) or []
         history.append({
             'conversation_id': entry.conversation_id,
             'created_at': entry.created_at,
-            'title': entry.history[0]['content']
+            'last_activity': entry.last_activity,
+            'title': entry.title or (conversation_title(messages[0]) if messages else ""),
+            'preview': entry.preview or (conversation_preview(messages[-1]) if messages else "")
         })
     return history
 
 @router.get("/chat/history/conversation/{conversation_id}")
-async def get_chat_history_by_conversation_id(conversation_id: str, db: Session = Depends(get_db)):
-    chat_entry = db.query(Conversation).filter(Conversation.conversation_id == conversation_id).first()
-    return chat_entry.history
+async def get_chat_history_by_conversation_id(conversation_id: int, db: AsyncSession = Depends(get_async_db)):
+    messages, _ = await read_messages(db, None, conversation_id)
+    return messages
 
@@ -1,22 +1,30 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
 
-from brain.model_init import ChatModel
+from brain.model_init import chat_model
+from brain.scheduler import SchedulerBusy, model_scheduler
+from brain.sse import cancel_on_disconnect
 router = APIRouter()
-chat_model = ChatModel()
 
 @router.get("/health")
-async def health_check(query: str = None):
+async def health_check(request: Request, query: str = None):
 
     try:
         if not query:
             return {"error": "Query is required"}
 
+        # Cache hits and requests joining a running generation never reach the model;
+        # everything else may be rejected early
+        if not chat_model.is_health_cached(query, "health"):
+            model_scheduler.check_admission("health")
+
         # Generate a streaming response from the model
-        response_stream = chat_model.quick_streamed_health(query, "health")
+        response_stream = cancel_on_disconnect(request, chat_model.quick_streamed_health_async(query, "health"), "health")
 
         # Return the response as a streaming response
         return StreamingResponse(response_stream, media_type="text/event-stream")
 
+    except SchedulerBusy:
+        raise
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,16 @@
+from fastapi import APIRouter, HTTPException, Request
+from brain.media_store import media_store
+
+router = APIRouter()
+
+@router.get("/media/{name}")
+async def get_media(request: Request, name: str, thumbnail: bool = False):
+    """
+    Serve a media store blob by its file name (the basename of a stored path, e.g. <sha256>.jpg).
+    No database lookup: the name is the content hash. thumbnail=true returns a small preview of an image.
+    Supports If-None-Match (304) and Range requests.
+    """
+    path = media_store.resolve(name)
+    if not path:
+        raise HTTPException(status_code=404, detail="File not found")
+    return await media_store.file_response(request, path, thumbnail=thumbnail)
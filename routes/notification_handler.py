@@ -1,12 +1,13 @@
 import os
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
 from pydantic import BaseModel
 from datetime import datetime
-from db.getdb import get_db
+from brain.media_store import media_store
+from brain.uploads import AUDIO_TYPES, IMAGE_TYPES
+from db.getdb import get_async_db, get_db
 from db.models import AdminNotification, User
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-import mimetypes
 
 router = APIRouter()
 
@@ -35,28 +36,24 @@ def send_notification(
     file: UploadFile = File(None),
     db: Session = Depends(get_db)
 ):
-    # Create separate directories for images and voice files
-    os.makedirs("uploads/images", exist_ok=True)
-    os.makedirs("uploads/voice", exist_ok=True)
-    
     image_path = None
     voice_path = None
     
     if file:
         file_type = get_file_type(file)
-        if file_type == 'image':
-            image_path = f"uploads/images/{file.filename}"
-            with open(image_path, "wb") as f:
-                f.write(file.file.read())
-        elif file_type == 'voice':
-            voice_path = f"uploads/voice/{file.filename}"
-            with open(voice_path, "wb") as f:
-                f.write(file.file.read())
-        else:
+        if file_type not in ('image', 'voice'):
             raise HTTPException(
                 status_code=400,
                 detail="Invalid file type. Only image and voice files are allowed."
             )
+        # The content must match the declared type
+        allowed = IMAGE_TYPES if file_type == 'image' else AUDIO_TYPES
+        stored = media_store.save_sync(file, allowed=allowed)
+        media_store.add_ref(db, stored.path)
+        if file_type == 'image':
+            image_path = stored.path
+        else:
+            voice_path = stored.path
 
     note = AdminNotification(
         user_id=user_id,
@@ -108,26 +105,35 @@ def complete_notification(
     if not notif:
         raise HTTPException(status_code=404, detail="Notification not found")
     
+    if image_file:
+        # Stored before the notification is touched: saving commits the blob's own row
+        stored = media_store.save_sync(image_file)
+        media_store.release(db, notif.admin_image_path)
+        media_store.add_ref(db, stored.path)
+        notif.admin_image_path = stored.path
+
     notif.last_admin_coordinate = last_admin_coordinate
     notif.action_details = action_details
     notif.status = "completed"
     notif.completed_time = datetime.utcnow()
-    if image_file:
-        image_path = f"static/evidence/{notification_id}_{image_file.filename}"
-        with open(image_path, "wb") as f:
-            f.write(image_file.file.read())
-        notif.admin_image_path = image_path
 
     db.commit()
     return {"status": "success", "message": "Notification completed"}
 
 @router.get('/notify/file/{notification_id}')
-async def get_notification_file(notification_id: int, file_type: str, db: Session = Depends(get_db)):
+async def get_notification_file(
+    request: Request,
+    notification_id: int,
+    file_type: str,
+    thumbnail: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
     """
     Get a file associated with a notification.
-    file_type should be either 'image' or 'voice'
+    file_type should be either 'image' or 'voice'; thumbnail=true returns a small preview of an image.
+    Supports If-None-Match (304) and Range requests.
     """
-    notification = db.query(AdminNotification).filter(AdminNotification.id == notification_id).first()
+    notification = await db.get(AdminNotification, notification_id)
     if not notification:
         raise HTTPException(status_code=404, detail="Notification not found")
 
@@ -139,11 +145,9 @@ async def get_notification_file(notification_id: int, file_type: str, db: Sessio
     else:
         raise HTTPException(status_code=400, detail="Invalid file type. Must be either 'image' or 'voice'")
 
-    if not file_path or not os.path.exists(file_path):
+    if not file_path:
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(
-        path=file_path,
-        filename=os.path.basename(file_path),
-        media_type=mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+    return await media_store.file_response(
+        request, file_path, thumbnail=thumbnail, filename=os.path.basename(file_path)
     ) 
\ No newline at end of file
@@ -1,21 +1,31 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
-from brain.model_init import ChatModel
+from brain.model_init import chat_model
+from brain.scheduler import SchedulerBusy, model_scheduler
+from brain.sse import cancel_on_disconnect
 from fastapi import Request
 
 router = APIRouter()
-chat_model = ChatModel()
 @router.get("/road-safety") 
-async def health_check(prompt: str = None):
+async def health_check(request: Request, prompt: str = None):
     try:
         if not prompt:
             return {"error": "Prompt is required"}
 
+        # Cache hits and requests joining a running generation never reach the model;
+        # everything else may be rejected early
+        if not chat_model.is_health_cached(prompt, "road-safety"):
+            model_scheduler.check_admission("road-safety")
+
         # Generate a streaming response from the model
-        response_stream = chat_model.quick_streamed_health(prompt, "road-safety")
+        response_stream = cancel_on_disconnect(
+            request, chat_model.quick_streamed_health_async(prompt, "road-safety"), "road-safety"
+        )
 
         # Return the response as a streaming response
         return StreamingResponse(response_stream, media_type="text/event-stream")
 
+    except SchedulerBusy:
+        raise
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file
@@ -0,0 +1,85 @@
+from fastapi import APIRouter
+
+from brain.conversation_state import conversation_states
+from brain.image_pipeline import image_pipeline
+from brain.media_store import media_store
+from brain.model_router import model_router
+from brain.ollama_client import ollama_client
+from brain.response_cache import response_cache
+from brain.scheduler import model_scheduler
+from brain.search_engine import searx_client
+from brain.single_flight import single_flight
+from brain.startup import startup_report
+from brain.sse import SSE_COALESCE, get_stream_stats
+from configs.prompt_registry import prompt_registry
+from db.database import pool_stats
+
+router = APIRouter()
+
+@router.get("/stats/stream")
+async def stream_stats():
+    """
+    SSE output counters per endpoint (frames/sec, bytes/sec, tokens per frame).
+    Run once with SSE_COALESCE=0 to get the per-token baseline to compare against.
+    """
+    return {"coalescing": SSE_COALESCE, "endpoints": get_stream_stats()}
+
+@router.get("/stats/cache")
+async def cache_stats():
+    """Hit/miss counters and size of the /health and /road-safety response cache."""
+    return response_cache.stats()
+
+@router.get("/stats/scheduler")
+async def scheduler_stats():
+    """In-flight generations, queue depth per priority class and rejection/preemption counters."""
+    return model_scheduler.stats()
+
+@router.get("/stats/prompts")
+async def prompt_stats():
+    """Size, token estimate and digest of every precompiled system prompt."""
+    return prompt_registry.summary()
+
+@router.get("/stats/conversations")
+async def conversation_state_stats():
+    """Size and eviction counters of the per-conversation in-memory state store."""
+    return conversation_states.stats()
+
+@router.get("/stats/search")
+async def search_stats():
+    """SearXNG result cache and request coalescing counters."""
+    return searx_client.stats()
+
+@router.get("/stats/startup")
+async def startup_stats():
+    """Import and startup time per phase, and whether the model warm-up has finished."""
+    return startup_report.summary()
+
+@router.get("/stats/backends")
+async def backend_stats():
+    """Outstanding requests, failures, ejections and latency of every model backend."""
+    return ollama_client.stats()
+
+@router.get("/stats/models")
+async def model_stats():
+    """Router configuration, recent TTFT per model and the expected TTFT per endpoint."""
+    return model_router.stats()
+
+@router.get("/stats/single-flight")
+async def single_flight_stats():
+    """Shared generations in progress and how many requests started or joined one."""
+    return single_flight.stats()
+
+@router.get("/stats/images")
+async def image_stats():
+    """Image preprocessing cache hits and bytes before/after downscaling."""
+    return image_pipeline.stats()
+
+@router.get("/stats/media")
+async def media_stats():
+    """Blobs stored and deduplicated by the media store, and the last garbage-collection pass."""
+    return media_store.stats()
+
+@router.get("/stats/db")
+async def db_stats():
+    """Connections in use and overflow of the sync and async database pools; checkout waits are in /metrics."""
+    return pool_stats()
@@ -1,13 +1,13 @@
 from fastapi import Request , APIRouter
 from fastapi.responses import JSONResponse
-from brain.model_init import ChatModel
+from brain.model_init import chat_model
+from brain.scheduler import SchedulerBusy, model_scheduler
+from brain.sse import cancel_on_disconnect
 from fastapi.responses import StreamingResponse
 
-# Initialize the ChatModel
-chat_model = ChatModel()
 router = APIRouter()
 @router.post("/voice")
-async def voice_chat(prompt :str  ):
+async def voice_chat(prompt :str, request: Request):
     """
     Route to handle voice-like streaming responses.
     The client sends a prompt, and the server streams the model's response.
@@ -16,11 +16,18 @@ async def voice_chat(prompt :str  ):
         if not prompt:
             return {"error": "Prompt is required"}
 
+        # Reject early with 429/503 if the model queue is full, unless the same
+        # question is already being answered and this request can share it
+        if not chat_model.is_voice_in_flight(prompt):
+            model_scheduler.check_admission("voice")
+
         # Generate a streaming response from the model
-        response_stream = chat_model.quick_streamed_response(prompt)
+        response_stream = cancel_on_disconnect(request, chat_model.quick_streamed_response_async(prompt), "voice")
 
         # Return the response as a streaming response
         return StreamingResponse(response_stream, media_type="text/event-stream")
 
+    except SchedulerBusy:
+        raise
     except Exception as e:
         return {"error": str(e)}
\ No newline at end of file